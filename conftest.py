@@ -0,0 +1 @@
+# the repository root is put on sys.path through this file, so the tests import src with plain pytest as well
@@ -1,11 +1,18 @@
 import math
+import os
 import random
-from typing import Sequence, List, Tuple, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Sequence, Tuple, Optional, Callable, Dict
 
 import numpy
 from PIL import Image
 from matplotlib import pyplot
 
+from src.fractal.stamping import stamp_ball, stamp_cross
+from src.tools import Progress, ProgressPhase
+
 TILESIZE_RANDOMIZATION_FACTOR = Tuple[int, float, float]
 
 
@@ -50,107 +57,224 @@ def _render(image: Image) -> Image:
     return rendered
 
 
-def _set_intermediates(grid: Sequence[List[float]], randomization: float, x_origin: int, y_origin: int, window: int):
-    x_mid = x_origin + window // 2
-    y_mid = y_origin + window // 2
-
-    row_top = grid[y_origin]
-    row_mid = grid[y_mid]
-    row_bot = grid[y_origin + window]
-
-    value_nw = row_top[x_origin]
-    value_ne = row_top[x_origin + window]
-    value_se = row_bot[x_origin + window]
-    value_sw = row_bot[x_origin]
+def _fill_undefined(target: numpy.ndarray, values: numpy.ndarray, noise: numpy.ndarray, randomization: float, rng: numpy.random.Generator):
+    # values and noise are scratch arrays of the target's shape, both are overwritten
+    rng.random(out=noise, dtype=numpy.float32)
+    noise *= 2. * randomization
+    noise -= randomization
+    values += noise
+    numpy.clip(values, 0., 1., out=values)
+    numpy.copyto(target, values, where=target < 0.)
 
-    value_e = (value_ne + value_se) / 2.
-    if row_mid[x_origin + window] < 0.:
-        row_mid[x_origin + window] = _randomize(value_e, randomization)
 
-    value_s = (value_se + value_sw) / 2.
-    if row_bot[x_mid] < 0.:
-        row_bot[x_mid] = _randomize(value_s, randomization)
+def _add_noise(grid: numpy.ndarray, tile_size: int, randomization: float, rng: numpy.random.Generator):
+    # every edge of the grid must be a multiple of tile_size plus one, negative cells are undefined
+    height, width = grid.shape
+    assert (height - 1) % tile_size == 0
+    assert (width - 1) % tile_size == 0
 
-    value_n = (value_nw + value_ne) / 2.
-    if row_top[x_mid] < 0. and y_origin == 0:
-        row_top[x_mid] = _randomize(value_n, randomization)
+    # initial corners
+    corners = grid[::tile_size, ::tile_size]
+    numpy.copyto(corners, rng.random(corners.shape, dtype=numpy.float32), where=corners < 0.)
 
-    value_w = (value_sw + value_nw) / 2.
-    if row_mid[x_origin] < 0. and x_origin == 0:
-        row_mid[x_origin] = _randomize(value_w, randomization)
+    # scratch memory for the finest level, coarser levels use the beginning of it
+    size_scratch = ((height - 1) // 2 + 1) * ((width - 1) // 2 + 1)
+    scratch_values = numpy.empty(size_scratch, dtype=numpy.float32)
+    scratch_noise = numpy.empty(size_scratch, dtype=numpy.float32)
 
-    value_m = (value_nw + value_ne + value_se + value_sw) / 4.
-    if row_mid[x_mid] < 0.:
-        row_mid[x_mid] = _randomize(value_m, randomization)
+    def scratch(shape: Tuple[int, int]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        size = shape[0] * shape[1]
+        return scratch_values[:size].reshape(shape), scratch_noise[:size].reshape(shape)
 
-
-def _add_noise(grid: Sequence[List[float]], tile_size: int, randomization: float):
-    size = len(grid)
     window_size = tile_size
-
     while 1 < window_size:
-
-        _y = 0
-        while _y < size - window_size:
-            row = grid[_y]
-            row_next = grid[_y + window_size]
-
-            _x = 0
-            while _x < size - window_size:
-
-                # initial corners
-                if window_size == tile_size:
-                    if row[_x] < 0.:
-                        row[_x] = random.random()
-
-                    if row[_x + window_size] < 0.:
-                        row[_x + window_size] = random.random()
-
-                    if row_next[_x + window_size] < 0.:
-                        row_next[_x + window_size] = random.random()
-
-                    if row_next[_x] < 0.:
-                        row_next[_x] = random.random()
-
-                _set_intermediates(grid, randomization, _x, _y, window_size)
-
-                _x = _x + window_size
-
-            _y += window_size
-
-        window_size //= 2
+        half = window_size // 2
+        corners = grid[::window_size, ::window_size]
+
+        target = grid[half::window_size, ::window_size]
+        values, noise = scratch(target.shape)
+        numpy.add(corners[:-1, :], corners[1:, :], out=values)
+        values *= .5
+        _fill_undefined(target, values, noise, randomization, rng)
+
+        target = grid[::window_size, half::window_size]
+        values, noise = scratch(target.shape)
+        numpy.add(corners[:, :-1], corners[:, 1:], out=values)
+        values *= .5
+        _fill_undefined(target, values, noise, randomization, rng)
+
+        target = grid[half::window_size, half::window_size]
+        values, noise = scratch(target.shape)
+        numpy.add(corners[:-1, :-1], corners[:-1, 1:], out=values)
+        values += corners[1:, 1:]
+        values += corners[1:, :-1]
+        values *= .25
+        _fill_undefined(target, values, noise, randomization, rng)
+
+        window_size = half
+
+
+def _composite(
+        grid: numpy.ndarray, components: Sequence[TILESIZE_RANDOMIZATION_FACTOR],
+        add_component: Callable[[numpy.ndarray, int, float, numpy.random.Generator], None],
+        rng: numpy.random.Generator, max_workers: Optional[int] = None, progress: Optional[Progress] = None,
+        executor: Optional[ThreadPoolExecutor] = None) -> numpy.ndarray:
+    # every component gets its own generator and is summed up in order, the result does not depend on the number of
+    # workers. at most one buffer per worker is in use besides the accumulator. a given executor is reused, otherwise
+    # one is started for this call.
+    rngs = [numpy.random.default_rng(_seed) for _seed in rng.integers(0, 2 ** 63, size=len(components))]
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(components)))
+
+    buffers_free = [numpy.empty(grid.shape, dtype=numpy.float32) for _ in range(max_workers)]
+
+    def generate(buffer: numpy.ndarray, tile_size: int, randomization: float, rng_component: numpy.random.Generator) -> numpy.ndarray:
+        numpy.copyto(buffer, grid)
+        add_component(buffer, tile_size, randomization, rng_component)
+        return buffer
+
+    grid_noise_full = numpy.zeros(grid.shape, dtype=numpy.float32)
+    factor_sum = sum(_factor for _, _, _factor in components)
+
+    if max_workers < 2:
+        buffer, = buffers_free
+        with ProgressPhase(progress, "components", total=len(components)) as phase:
+            for (tile_size, randomization, factor), rng_component in zip(components, rngs):
+                generate(buffer, tile_size, randomization, rng_component)
+                buffer *= factor
+                grid_noise_full += buffer
+                phase.advance(cells=grid.size)
+
+    else:
+        executor_context = ThreadPoolExecutor(max_workers=max_workers) if executor is None else nullcontext(executor)
+        with executor_context as executor, ProgressPhase(progress, "components", total=len(components)) as phase:
+            pending = deque()
+            for (tile_size, randomization, factor), rng_component in zip(components, rngs):
+                if len(buffers_free) < 1:
+                    future, factor_done = pending.popleft()
+                    buffer = future.result()
+                    buffer *= factor_done
+                    grid_noise_full += buffer
+                    buffers_free.append(buffer)
+                    phase.advance(cells=grid.size)
+
+                future = executor.submit(generate, buffers_free.pop(), tile_size, randomization, rng_component)
+                pending.append((future, factor))
+
+            while 0 < len(pending):
+                future, factor_done = pending.popleft()
+                buffer = future.result()
+                buffer *= factor_done
+                grid_noise_full += buffer
+                phase.advance(cells=grid.size)
+
+    grid_noise_full /= factor_sum
+    return grid_noise_full
 
 
 # TODO:
 #   0.: implement complete 1-dimensional case
 #   1.: make n-dimensional
 #   2.: add offset in each dimension (not as parameters but integrated)
-def _create_noise(grid: Sequence[List[float]], components: Sequence[TILESIZE_RANDOMIZATION_FACTOR]) -> Sequence[List[float]]:
-    assert is_power_two(len(grid) - 1)
-    assert all(is_power_two(len(row) - 1) for row in grid)
+def _create_noise(grid: Sequence[Sequence[float]], components: Sequence[TILESIZE_RANDOMIZATION_FACTOR], rng: Optional[numpy.random.Generator] = None, max_workers: Optional[int] = None, progress: Optional[Progress] = None, executor: Optional[ThreadPoolExecutor] = None) -> numpy.ndarray:
+    grid = numpy.asarray(grid, dtype=numpy.float32)
+    assert all(is_power_two(_s - 1) for _s in grid.shape)
 
-    grid_noise_full = [[0. for _ in row] for row in grid]
-    factor_sum = 0.
-    for tile_size, randomization, factor in components:
-        grid_copy = [[_v for _v in row] for row in grid]
-        _add_noise(grid_copy, tile_size, randomization)
+    if rng is None:
+        rng = numpy.random.default_rng(random.getrandbits(64))
 
-        for row, row_noise in zip(grid_noise_full, grid_copy):
-            for _x, value in enumerate(row_noise):
-                s = row[_x] + value * factor
-                row[_x] = s
+    return _composite(grid, components, _add_noise, rng, max_workers=max_workers, progress=progress, executor=executor)
 
-        factor_sum += factor
 
-    for row in grid_noise_full:
-        for _x, value in enumerate(row):
-            row[_x] = value / factor_sum
+def _add_noise_line(line: numpy.ndarray, tile_size: int, window_stop: int, randomization: float, rng: numpy.random.Generator):
+    # midpoint displacement along one edge for the windows that are larger than window_stop
+    corners = line[::tile_size]
+    numpy.copyto(corners, rng.random(corners.shape, dtype=numpy.float32), where=corners < 0.)
 
-    return grid_noise_full
+    window_size = tile_size
+    while window_stop < window_size:
+        half = window_size // 2
+        corners = line[::window_size]
+        values = corners[:-1] + corners[1:]
+        values *= .5
+        _fill_undefined(line[half::window_size], values, numpy.empty_like(values), randomization, rng)
+        window_size = half
+
+
+def _strip_aligned(distance: int, tile_size: int) -> bool:
+    # the strip windows must subdivide the windows of the whole grid, otherwise the grid is regenerated
+    window_size = min(tile_size, distance)
+    return distance % window_size == 0 and tile_size % window_size == 0
+
+
+def _add_noise_strip(strip: numpy.ndarray, tile_size: int, randomization: float, rng: numpy.random.Generator):
+    strip_rows = strip.shape[0] - 1
+    window_size = min(tile_size, strip_rows)
+    assert strip_rows % window_size == 0
+
+    if window_size < tile_size:
+        _add_noise_line(strip[0], tile_size, window_size, randomization, rng)
+    _add_noise(strip, window_size, randomization, rng)
+
+
+def _create_noise_strip(strip: numpy.ndarray, components: Sequence[TILESIZE_RANDOMIZATION_FACTOR], rng: Optional[numpy.random.Generator] = None, max_workers: Optional[int] = None, progress: Optional[Progress] = None, executor: Optional[ThreadPoolExecutor] = None) -> numpy.ndarray:
+    # row 0 is the outer edge of a newly exposed strip, the last row is retained from the grid. this produces the
+    # same structure as _create_noise over the whole grid, windows larger than the strip only touch its outer edge.
+    if rng is None:
+        rng = numpy.random.default_rng(random.getrandbits(64))
+
+    return _composite(numpy.asarray(strip, dtype=numpy.float32), components, _add_noise_strip, rng, max_workers=max_workers, progress=progress, executor=executor)
+
+
+def _zoom_in_grid(grid: numpy.ndarray, ratio: float) -> numpy.ndarray:
+    # the centre window is spread out by 1 / ratio, everything between stays undefined
+    grid_size = grid.shape[0]
+    edge_size = math.ceil(grid_size * ratio)
+    offset = (grid_size - edge_size) // 2
+    window = grid[offset:offset + edge_size, offset:offset + edge_size]
+
+    grid_new = numpy.full_like(grid, -1.)
+    step = 1. / ratio
+    if step.is_integer():
+        grid_new[::int(step), ::int(step)] = window
+    else:
+        targets = numpy.arange(edge_size) // ratio
+        targets = targets.astype(numpy.intp)
+        grid_new[numpy.ix_(targets, targets)] = window
+    return grid_new
+
+
+def _zoom_out_grid(grid: numpy.ndarray, ratio: float, area: bool = False) -> numpy.ndarray:
+    # every ratio-th cell moves to the centre window, averaged over its block if area is set
+    grid_size = grid.shape[0]
+    sources = numpy.floor(numpy.arange(0., grid_size, ratio)).astype(numpy.intp)
+    edge_size = round(grid_size // ratio)
+    offset = (grid_size - edge_size) // 2
+
+    if area:
+        counts = numpy.diff(sources, append=grid_size).astype(numpy.float32)
+        window = numpy.add.reduceat(numpy.add.reduceat(grid, sources, axis=0), sources, axis=1)
+        window /= counts[:, None] * counts[None, :]
+    elif float(ratio).is_integer():
+        window = grid[::int(ratio), ::int(ratio)]
+    else:
+        window = grid[numpy.ix_(sources, sources)]
+
+    grid_new = numpy.full_like(grid, -1.)
+    grid_new[offset:offset + len(sources), offset:offset + len(sources)] = window
+    return grid_new
 
 
 class Map:
     def __init__(self, grid_size: int = 512 + 1, tile_size: int = 256, distance_transition: int = 64, value_min: int = 0, value_max: int = 255, grid_initial: Optional[Sequence[Sequence[int]]] = None):
+        if not is_power_two(grid_size - 1):
+            raise ValueError(f"grid size must be a power of two plus one, not {grid_size:d}")
+        if not is_power_two(tile_size) or grid_size <= tile_size:
+            raise ValueError(f"tile size must be a power of two below the grid size {grid_size:d}, not {tile_size:d}")
+        if not 0 < distance_transition < grid_size:
+            raise ValueError(f"transition distance must be between 1 and {grid_size - 1:d}, not {distance_transition:d}")
+
         self._grid_size = grid_size
         self._distance_transition = distance_transition
         self._value_min, self._value_max = value_min, value_max
@@ -159,115 +283,138 @@ class Map:
             # (tile_size, self._grid_size / (4. * 2048.), 1.0),
             (tile_size, .1, 1.0),
         )
+        # one executor for all components of all moves, none if there is only one component
+        workers = min(len(self._components), os.cpu_count() or 1)
+        self._executor = ThreadPoolExecutor(max_workers=workers) if 1 < workers else None
+
+        # moves only generate the newly exposed strip if its windows line up with the grid's
+        self._strips = all(_strip_aligned(distance_transition, _tile_size) for _tile_size, _, _ in self._components)
 
         if grid_initial is None:
             grid_initial = [[-1. for _ in range(grid_size)] for _ in range(grid_size)]
 
-        self._tile_current = _create_noise(grid_initial, self._components)
+        # the grid is toroidal, logical cell (0, 0) is at physical cell (origin_y, origin_x)
+        self._grid = _create_noise(grid_initial, self._components, executor=self._executor)
+        self._origin_y, self._origin_x = 0, 0
 
-    def _add_x(self):
-        self._tile_current = [
-            [float(_x < _y)
-             if self._grid_size // 2 - 5 < _y < self._grid_size // 2 + 5 or self._grid_size // 2 - 5 < _x < self._grid_size // 2 + 5
-             else value
-             for _x, value in enumerate(row)]
-            for _y, row in enumerate(self._tile_current)
-        ]
+        # grids of other zoom levels by log2 of their scale, valid until the map changes
+        self._pyramid = dict()  # type: Dict[float, Tuple[numpy.ndarray, int, int]]
+        self._zoom_level = 0.
 
-    def move_north(self):
-        for x in range(self._grid_size):
-            for y in range(self._grid_size - self._distance_transition - 1, -1, -1):
-                row = self._tile_current[y]
-                value = row[x]
+    def __enter__(self) -> "Map":
+        return self
 
-                row_next = self._tile_current[y + self._distance_transition]
-                row_next[x] = value
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-            for y in range(self._distance_transition):
-                row = self._tile_current[y]
-                row[x] = -1.
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
 
-        self._tile_current = _create_noise(self._tile_current, self._components)
+    def _grid_logical(self) -> numpy.ndarray:
+        return numpy.roll(self._grid, (-self._origin_y, -self._origin_x), axis=(0, 1))
 
-    def move_east(self):
-        for y in range(self._grid_size):
-            row = self._tile_current[y]
-            for x in range(self._distance_transition, self._grid_size):
-                value = row[x]
-                row[x - self._distance_transition] = value
+    def _set_grid(self, grid: Sequence[Sequence[float]]):
+        self._grid = numpy.asarray(grid, dtype=numpy.float32)
+        self._origin_y, self._origin_x = 0, 0
 
-            for x in range(self._grid_size - self._distance_transition, self._grid_size):
-                row[x] = -1.
+    def _changed(self):
+        self._pyramid.clear()
 
-        self._tile_current = _create_noise(self._tile_current, self._components)
+    def _indices(self, origin: int, start: int, stop: int) -> numpy.ndarray:
+        return (origin + numpy.arange(start, stop)) % self._grid_size
 
-    def move_south(self):
-        for x in range(self._grid_size):
-            for y in range(self._distance_transition, self._grid_size):
-                row = self._tile_current[y]
-                row_prev = self._tile_current[y - self._distance_transition]
-                value = row[x]
-                row_prev[x] = value
+    def _regenerate(self, rows: numpy.ndarray, columns: numpy.ndarray):
+        # fallback for strips that do not line up, the exposed cells are cleared and the whole grid is filled
+        self._grid[numpy.ix_(rows, columns)] = -1.
+        self._set_grid(_create_noise(self._grid_logical(), self._components, executor=self._executor))
+
+    def _add_x(self):
+        self._changed()
+        if self._origin_y != 0 or self._origin_x != 0:
+            self._set_grid(self._grid_logical())
+        center = self._grid_size // 2
+        stamp_cross(self._grid, (center, center), (5, 5), value=lambda _y, _x: _x < _y)
 
-            for y in range(self._grid_size - self._distance_transition, self._grid_size):
-                row = self._tile_current[y]
-                row[x] = -1.
+    def move_north(self):
+        self._changed()
+        distance = self._distance_transition
+        self._origin_y = (self._origin_y - distance) % self._grid_size
+        rows = self._indices(self._origin_y, 0, distance + 1)
+        columns = self._indices(self._origin_x, 0, self._grid_size)
+        if not self._strips:
+            self._regenerate(rows[:distance], columns)
+            return
 
-        self._tile_current = _create_noise(self._tile_current, self._components)
+        strip = self._grid[numpy.ix_(rows, columns)]
+        strip[:distance] = -1.
+        strip = _create_noise_strip(strip, self._components, executor=self._executor)
+        self._grid[numpy.ix_(rows[:distance], columns)] = strip[:distance]
 
-    def move_west(self):
-        for y in range(self._grid_size):
-            row = self._tile_current[y]
-            for x in range(self._grid_size - self._distance_transition - 1, -1, -1):
-                value = row[x]
-                row[x + self._distance_transition] = value
+    def move_east(self):
+        self._changed()
+        distance = self._distance_transition
+        self._origin_x = (self._origin_x + distance) % self._grid_size
+        rows = self._indices(self._origin_y, 0, self._grid_size)
+        columns = self._indices(self._origin_x, self._grid_size - distance - 1, self._grid_size)
+        if not self._strips:
+            self._regenerate(rows, columns[1:])
+            return
+
+        strip = self._grid[numpy.ix_(rows, columns)]
+        strip[:, 1:] = -1.
+        strip = _create_noise_strip(strip.T[::-1], self._components, executor=self._executor)[::-1].T
+        self._grid[numpy.ix_(rows, columns[1:])] = strip[:, 1:]
+
+    def move_south(self):
+        self._changed()
+        distance = self._distance_transition
+        self._origin_y = (self._origin_y + distance) % self._grid_size
+        rows = self._indices(self._origin_y, self._grid_size - distance - 1, self._grid_size)
+        columns = self._indices(self._origin_x, 0, self._grid_size)
+        if not self._strips:
+            self._regenerate(rows[1:], columns)
+            return
+
+        strip = self._grid[numpy.ix_(rows, columns)]
+        strip[1:] = -1.
+        strip = _create_noise_strip(strip[::-1], self._components, executor=self._executor)[::-1]
+        self._grid[numpy.ix_(rows[1:], columns)] = strip[1:]
 
-            for x in range(self._distance_transition):
-                row[x] = -1.
+    def move_west(self):
+        self._changed()
+        distance = self._distance_transition
+        self._origin_x = (self._origin_x - distance) % self._grid_size
+        rows = self._indices(self._origin_y, 0, self._grid_size)
+        columns = self._indices(self._origin_x, 0, distance + 1)
+        if not self._strips:
+            self._regenerate(rows, columns[:distance])
+            return
 
-        self._tile_current = _create_noise(self._tile_current, self._components)
+        strip = self._grid[numpy.ix_(rows, columns)]
+        strip[:, :distance] = -1.
+        strip = _create_noise_strip(strip.T, self._components, executor=self._executor).T
+        self._grid[numpy.ix_(rows, columns[:distance])] = strip[:, :distance]
+
+    def _zoom(self, ratio: float, resample: Callable[[numpy.ndarray], numpy.ndarray]):
+        # the physical grid and its origin are handed over, so returning to a level costs no copy
+        self._pyramid[self._zoom_level] = self._grid, self._origin_y, self._origin_x
+        self._zoom_level = round(self._zoom_level + math.log2(ratio), 9)
+        cached = self._pyramid.pop(self._zoom_level, None)
+        if cached is not None:
+            self._grid, self._origin_y, self._origin_x = cached
+            return
+        self._set_grid(_create_noise(resample(self._grid_logical()), self._components, executor=self._executor))
 
     def zoom_in(self, ratio: float = .5):
-        tile_new = [[-1. for _ in range(self._grid_size)] for _ in range(self._grid_size)]
-        edge_size = math.ceil(self._grid_size * ratio)
-        offset = (self._grid_size - edge_size) // 2
-        for x in range(edge_size):
-            for y in range(edge_size):
-                row = self._tile_current[offset + y]
-                value = row[offset + x]
-                row_new = tile_new[round(y // ratio)]
-                row_new[round(x // ratio)] = value
-
-        self._tile_current = _create_noise(tile_new, self._components)
-
-    def zoom_out(self, ratio: float = 2.):
-        tile_new = [[-1. for _ in range(self._grid_size)] for _ in range(self._grid_size)]
-        edge_size = round(self._grid_size // ratio)
-        offset = (self._grid_size - edge_size) // 2
-        x_final = 0
-        _x = .0
-        while _x < self._grid_size:
-            y_final = 0
-            _y = .0
-            x = math.floor(_x)
-            while _y < self._grid_size:
-                y = math.floor(_y)
-                row = self._tile_current[y]
-                value = row[x]
-                row_new = tile_new[offset + y_final]
-                row_new[offset + x_final] = value
-                y_final += 1
-                _y += ratio
-            x_final += 1
-            _x += ratio
-
-        self._tile_current = _create_noise(tile_new, self._components)
+        self._zoom(ratio, lambda _grid: _zoom_in_grid(_grid, ratio))
+
+    def zoom_out(self, ratio: float = 2., area: bool = False):
+        self._zoom(ratio, lambda _grid: _zoom_out_grid(_grid, ratio, area=area))
 
     def save(self):
-        grid_new = [[_v for _v in row] for row in self._tile_current]
-        for row in grid_new:
-            for _x in range(len(row)):
-                row[_x] = self._value_min + row[_x] * (self._value_max - self._value_min)
+        grid_new = self._value_min + self._grid_logical() * (self._value_max - self._value_min)
 
         image = Image.fromarray(numpy.uint8(grid_new), mode="L")
         # image = _render(image)
@@ -277,10 +424,7 @@ class Map:
         pyplot.imsave("map.png", image, cmap="Greys", vmin=self._value_min, vmax=self._value_max)
 
     def draw(self):
-        grid_new = [[_v for _v in row] for row in self._tile_current]
-        for row in grid_new:
-            for _x in range(len(row)):
-                row[_x] = self._value_min + row[_x] * (self._value_max - self._value_min)
+        grid_new = self._value_min + self._grid_logical() * (self._value_max - self._value_min)
 
         image = Image.fromarray(numpy.uint8(grid_new), mode="L")
         image = _render(image)
@@ -288,30 +432,47 @@ class Map:
         pyplot.imshow(image, cmap="gist_earth", vmin=self._value_min, vmax=self._value_max)
 
 
-def load_picture(file_path: str, channel: int = 0, x_offset: int = 0, y_offset: int = 0, size: int = -1) -> Sequence[Sequence[int]]:
-    image = Image.open(file_path, mode="r")
-    width, height = image.size
+def _seed_grid(source: numpy.ndarray, channel: int = 0, x_offset: int = 0, y_offset: int = 0, size: int = -1, channel_alpha: Optional[int] = None) -> numpy.ndarray:
+    # only the cropped window of source is read, so memory mapped sources stay on disk otherwise
+    if source.ndim == 2:
+        values, alpha = source, None
+    else:
+        values = source[:, :, channel]
+        alpha = None if channel_alpha is None else source[:, :, channel_alpha]
+
+    height, width = values.shape
     if size < 0:
         size = max(width, height)
+    scale = float(numpy.iinfo(source.dtype).max) if numpy.issubdtype(source.dtype, numpy.integer) else 1.
 
-    data_cropped = [
-        [
-            image.getpixel((x - x_offset, y - y_offset))[channel] / 255.
-            if 0 <= x - x_offset < width else -1.
-            for x in range(size)
-        ]
-        if 0 <= y - y_offset < height else [-1.] * size
-        for y in range(size)
-    ]
+    grid = numpy.full((size, size), -1., dtype=numpy.float32)
+    y_from, y_to = max(0, y_offset), min(size, y_offset + height)
+    x_from, x_to = max(0, x_offset), min(size, x_offset + width)
+    if y_to <= y_from or x_to <= x_from:
+        return grid
 
-    return data_cropped
+    slices_source = slice(y_from - y_offset, y_to - y_offset), slice(x_from - x_offset, x_to - x_offset)
+    target = grid[y_from:y_to, x_from:x_to]
+    numpy.divide(values[slices_source], scale, out=target, casting="unsafe")
+    if alpha is not None:
+        target[alpha[slices_source] == 0] = -1.
 
+    return grid
 
-def _add_circle(grid: Sequence[List[float]], x: int, y: int, radius: int):
-    for _y, row in enumerate(grid):
-        for _x in range(len(row)):
-            if (x-_x) ** 2 + (y-_y) ** 2 < radius ** 2:
-                row[_x] = 1.
+
+def load_picture(file_path: str, channel: int = 0, x_offset: int = 0, y_offset: int = 0, size: int = -1, channel_alpha: Optional[int] = None) -> numpy.ndarray:
+    if file_path.lower().endswith(".npy"):
+        source = numpy.load(file_path, mmap_mode="r")
+    else:
+        source = numpy.asarray(Image.open(file_path, mode="r"))
+    return _seed_grid(source, channel=channel, x_offset=x_offset, y_offset=y_offset, size=size, channel_alpha=channel_alpha)
+
+
+def load_raw(file_path: str, width: int, height: int, channels: int = 1, dtype: numpy.dtype = numpy.uint8, header_bytes: int = 0, channel: int = 0, x_offset: int = 0, y_offset: int = 0, size: int = -1, channel_alpha: Optional[int] = None) -> numpy.ndarray:
+    # headerless row major pixel data, e.g. a multi gigapixel scan, is mapped instead of loaded
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    source = numpy.memmap(file_path, dtype=dtype, mode="r", offset=header_bytes, shape=shape)
+    return _seed_grid(source, channel=channel, x_offset=x_offset, y_offset=y_offset, size=size, channel_alpha=channel_alpha)
 
 
 class Position:
@@ -345,8 +506,8 @@ def _main():
             (64, size / (2048. * 1.), .25),
         )
 
-    grid = [[-1. for _ in range(size + 1)] for _ in range(size + 1)]
-    _add_circle(grid, pos.x, pos.y, radius)
+    grid = numpy.full((size + 1, size + 1), -1., dtype=numpy.float32)
+    stamp_ball(grid, (pos.y, pos.x), radius)
     random.seed(232323423)
     grid = _create_noise(grid, components)
 
@@ -366,8 +527,8 @@ def _main():
         else:
             return
 
-        grid = [[-1. for _ in range(size + 1)] for _ in range(size + 1)]
-        _add_circle(grid, pos.x, pos.y, radius)
+        grid = numpy.full((size + 1, size + 1), -1., dtype=numpy.float32)
+        stamp_ball(grid, (pos.y, pos.x), radius)
         random.seed(232323423)
         grid = _create_noise(grid, components)
 
@@ -384,9 +545,7 @@ def main():
     size = 1024
     pic_01 = "D:/Eigene Dateien/Downloads/NicePng_galaxy-png_125876.png"
     pic_02 = "D:/Eigene Dateien/Bilder/600px-Neues_Sat._1_Logo_transparent.png"
-    grid_color = load_picture(pic_01, channel=0, x_offset=100, y_offset=200, size=size+1)
-    grid_opaque = load_picture(pic_01, channel=3, x_offset=100, y_offset=200, size=size+1)
-    grid_color = [[-1. if row_transparency[_x] == 0. else _v for _x, _v in enumerate(row_color)] for row_transparency, row_color in zip(grid_opaque, grid_color)]
+    grid_color = load_picture(pic_01, channel=0, x_offset=100, y_offset=200, size=size+1, channel_alpha=3)
     map_tiles = Map(grid_size=size + 1, tile_size=256, distance_transition=128, grid_initial=grid_color)
     # map_tiles = Map(grid_size=size + 1, tile_size=1024, distance_transition=128)
 
@@ -422,6 +581,7 @@ def main():
     fig.canvas.mpl_connect("key_press_event", press)
     map_tiles.draw()
     pyplot.show()
+    map_tiles.close()
 
 
 if __name__ == '__main__':
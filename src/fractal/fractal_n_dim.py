@@ -2,9 +2,13 @@
 
 import itertools
 import math
+import os
 import random
-from functools import reduce
-from typing import List, Tuple, Any, Optional, Iterable, Union, Set, Sequence, Generator
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from functools import reduce, lru_cache
+from typing import List, Tuple, Any, Optional, Iterable, Union, Sequence, Generator, Dict
 
 import numpy
 from PIL import Image
@@ -12,92 +16,42 @@ from matplotlib import pyplot
 from matplotlib.pyplot import imread
 from numpy.lib.stride_tricks import as_strided
 
-from src.tools import Timer
-from src.notebooks.math_tools import uniform_areal_segmentation
+from src.fractal.stamping import stamp_cross
+from src.tools import Timer, Progress, ProgressPhase
 
 
 def is_power_two(n: int) -> bool:
     return n and (not (n & (n - 1)))
 
 
-def _scale_point_integer(point_normalized: Tuple[float, ...], factor: int, offsets: Optional[Tuple[int, ...]] = None) -> Tuple[int, ...]:
-    if offsets is None:
-        return tuple(int(math.floor(_v * factor)) for _v in point_normalized)
-    return tuple(int(math.floor(_v * factor)) + _o for _v, _o in zip(point_normalized, offsets))
-
-
-def _get_cube_corners(cube: Tuple[Tuple[int, ...], Tuple[int, ...]]) -> Set[Tuple[int, ...]]:
-    # (1, 4, 2), (6, 0, 3) ->
-    #   (1, 4, 2)
-    #   (1, 4, 3)
-    #   (1, 0, 2)
-    #   (1, 0, 3)
-    #   (6, 4, 2)
-    #   (6, 4, 3)
-    #   (6, 0, 2)
-    #   (6, 0, 3)
-
-    # (5, 2), (4, 0) ->
-    #
-
-    dim, = set(len(_point) for _point in cube)
-    return set(
-        tuple(
-            cube[_i][_d]
-            for _d, _i in enumerate(_indices)
-        )
-        for _indices in itertools.product(*((0, 1) for _ in range(dim)))
-    )
-
-    return set(
-        tuple(
-            _corner[_d]
-            for _d in range(dim)
-        )
-        for _corner in itertools.product(cube, dim)
-    )
-
-
-def _get_corner_edges(corners: Set[Tuple[int, ...]], no_shared_dimensions: int) -> Set[
-    Tuple[Tuple[int, ...], Tuple[int, ...]]]:
-    # (2, 4), (5, 4), (5, 1), (2, 1) ->
-    #   (2, 4), (5, 4)
-    #   (5, 4), (5, 1)
-    #   (5, 1), (2, 1)
-    #   (2, 1), (2, 4)
-
-    # https://de.wikipedia.org/wiki/Hyperw%C3%BCrfel#Grenzelemente
-    # no__edges = dim * 2. ** (dim - 1)
-    return set(
-        (_ca, _cb)
-        for _ca, _cb in itertools.combinations(corners, 2)
-        if sum(int(_a == _b) for _a, _b in zip(_ca, _cb)) >= no_shared_dimensions
-    )
-
-
-def _get_edge_midpoint(edge: Tuple[Tuple[int, ...], Tuple[int, ...]]) -> Tuple[int, ...]:
-    return tuple((_a + _b) // 2 for _a, _b in zip(*edge))
-
-
 def _randomize(value: float, randomization: float, bound_upper: float = 1., bound_lower: float = 0.) -> float:
     return min(bound_upper, max(bound_lower, value + random.uniform(-randomization, randomization)))
 
 
-def _array_segments(array: numpy.ndarray, shape_segments: Sequence[int], overlap: Optional[Sequence[int]] = None) -> Generator[numpy.ndarray, None, None]:
-    shape_array = array.shape
+def array_windows(array: numpy.ndarray, shape_segments: Sequence[int], step: Optional[Sequence[int]] = None) -> numpy.ndarray:
+    # view of all windows that fit, the first axes count windows and the last ones are the cells of a window
     dim = array.ndim
     assert len(shape_segments) == dim
-    bytes_item = array.itemsize
+    if step is None:
+        step = shape_segments
+    assert all(0 < _t for _t in step)
 
-    if overlap is None:
-        overlap = tuple(0 for _ in range(dim))
+    counts = tuple(max(0, (_a - _s) // _t + 1) for _a, _s, _t in zip(array.shape, shape_segments, step))
+    strides = tuple(_b * _t for _b, _t in zip(array.strides, step)) + array.strides
+    return as_strided(array, shape=counts + tuple(shape_segments), strides=strides, writeable=array.flags.writeable)
 
-    strides_segment = tuple(shape_segments[_i + 1] * bytes_item if _i < dim - 1 else bytes_item for _i in range(dim))
 
-    offsets = tuple(_a - _s + 1 - _o for _a, _s, _o in zip(shape_array, shape_segments, overlap))
-    slices = tuple(slice(start=_s, stop=None, step=None) for _o in offsets for _s in range(_o))
+def _array_segments(array: numpy.ndarray, shape_segments: Sequence[int], overlap: Optional[Sequence[int]] = None, step: Optional[Sequence[int]] = None) -> Generator[numpy.ndarray, None, None]:
+    # windows in C order, consecutive windows share overlap cells unless step is given
+    dim = array.ndim
+    if step is None:
+        if overlap is None:
+            overlap = tuple(0 for _ in range(dim))
+        step = tuple(_s - _o for _s, _o in zip(shape_segments, overlap))
 
-    yield from (as_strided(array[_each_slice], shape=shape_segments, strides=strides_segment) for _each_slice in slices)
+    windows = array_windows(array, shape_segments, step=step)
+    for _index in numpy.ndindex(*windows.shape[:dim]):
+        yield windows[_index]
 
 
 def _get_cube(grid: numpy.ndarray, coordinates: Sequence[int], size: int) -> numpy.ndarray:
@@ -108,113 +62,328 @@ def _get_cube(grid: numpy.ndarray, coordinates: Sequence[int], size: int) -> num
     return grid_cube
 
 
-def _set_grid_w(cube: numpy.ndarray, grid: numpy.ndarray, coordinates: Sequence[int], size: int):
-    """
-    indices = numpy.array(
-        tuple(
-            itertools.product(
-                *tuple(
-                    tuple(
-                        _v % _s
-                        for _v in range(_c, _c + size)
-                    )
-                    for _c, _s in zip(coordinates, grid.shape)
-                )
-            )
-        )
-    )
-
-    grid[indices[:, 0], indices[:, 1], indices[:, 2]] = cube
-    """
-    rolled = numpy.roll(a=grid, shift=tuple(-_c for _c in coordinates), axis=tuple(_i for _i in range(grid.ndim)))
-    slices_cube = tuple(slice(0, size + 1, None) for _ in grid.shape)
-    rolled[slices_cube] = cube
+@lru_cache(maxsize=1024)
+def _wrapped_range(start: int, length: int, size: int) -> numpy.ndarray:
+    return numpy.arange(start, start + length) % size
 
-    #"""
 
+def _cube_index(shape: Sequence[int], corner: Sequence[int], size: int) -> Tuple[Any, ...]:
+    # slices give a view when the cube lies inside the grid, otherwise modular indices for each axis
+    corner = tuple(_c % _s for _c, _s in zip(corner, shape))
+    if all(_c + size < _s for _c, _s in zip(corner, shape)):
+        return tuple(slice(_c, _c + size + 1) for _c in corner)
+    return numpy.ix_(*(_wrapped_range(_c, size + 1, _s) for _c, _s in zip(corner, shape)))
 
-def _get_cube_w(grid: numpy.ndarray, coordinates: Sequence[int], size: int) -> numpy.ndarray:
-    """
-    indices = numpy.array(
-        tuple(
-            itertools.product(
-                *tuple(
-                    tuple(
-                        _v % _s
-                        for _v in range(_c, _c + size)
-                    )
-                    for _c, _s in zip(coordinates, grid.shape)
-                )
-            )
-        )
-    )
-
-    return grid[indices[:, 0], indices[:, 1], indices[:, 2]]
-    """
-    rolled = numpy.roll(a=grid, shift=tuple(-_c for _c in coordinates), axis=tuple(_i for _i in range(grid.ndim)))
-    slices_cube = tuple(slice(0, size + 1, None) for _ in grid.shape)
-    return rolled[slices_cube]
-    #"""
+
+def _set_grid_w(cube: numpy.ndarray, grid: numpy.ndarray, coordinates: Sequence[int], size: int):
+    grid[_cube_index(grid.shape, coordinates, size)] = cube
 
 
-def _noise_cube(grid_cube: numpy.ndarray, randomization: float):
+def _get_cube_w(grid: numpy.ndarray, coordinates: Sequence[int], size: int) -> numpy.ndarray:
+    return grid[_cube_index(grid.shape, coordinates, size)]
+
+
+# per step: target indices, pairs of source indices with one row per axis of the subset, number of axes
+SCHEDULE_STEP = Tuple[Tuple[numpy.ndarray, ...], Tuple[numpy.ndarray, ...], Tuple[numpy.ndarray, ...], int]
+
+
+@lru_cache(maxsize=32)
+def _noise_schedule(dim: int, tile_size: int) -> Tuple[SCHEDULE_STEP, ...]:
+    # the midpoints _noise_cube used to find from corner and edge sets, as indices into a cube of tile_size + 1 points
+    shape = tuple(tile_size + 1 for _ in range(dim))
+    schedule = []
+    window = tile_size
+    while 2 <= window:
+        half = window // 2
+        for _no_axes in range(1, dim + 1):
+            targets, sources_a, sources_b = [], [], []
+            for _axes in itertools.combinations(range(dim), _no_axes):
+                ranges = tuple(numpy.arange(half, tile_size, window) if _j in _axes else numpy.arange(0, tile_size + 1, window) for _j in range(dim))
+                points = numpy.stack([_c.ravel() for _c in numpy.meshgrid(*ranges, indexing="ij")])
+                targets.append(numpy.ravel_multi_index(points, shape))
+                offsets = numpy.zeros((dim, 1), dtype=int)
+                pairs_a, pairs_b = [], []
+                for _i in _axes:
+                    offsets[_i] = half
+                    pairs_a.append(numpy.ravel_multi_index(points - offsets, shape))
+                    pairs_b.append(numpy.ravel_multi_index(points + offsets, shape))
+                    offsets[_i] = 0
+                sources_a.append(numpy.stack(pairs_a))
+                sources_b.append(numpy.stack(pairs_b))
+
+            schedule.append((
+                numpy.unravel_index(numpy.concatenate(targets), shape),
+                numpy.unravel_index(numpy.concatenate(sources_a, axis=1), shape),
+                numpy.unravel_index(numpy.concatenate(sources_b, axis=1), shape),
+                _no_axes))
+        window //= 2
+
+    return tuple(schedule)
+
+
+def _noise_cube(grid_cube: numpy.ndarray, randomization: float, rng: Optional[numpy.random.Generator] = None):
     dim = grid_cube.ndim
     tile_size, = set(_x - 1 for _x in grid_cube.shape)
+    if rng is None:
+        rng = numpy.random.default_rng(random.getrandbits(64))
 
-    generate_tiles = uniform_areal_segmentation(dim)
-    for _each_space, _each_center in generate_tiles:
-        cube = _scale_point_integer(_each_space[0], tile_size), _scale_point_integer(_each_space[1], tile_size)
+    for _targets, _sources_a, _sources_b, _no_axes in _noise_schedule(dim, tile_size):
+        values = (grid_cube[_sources_a] + grid_cube[_sources_b]).sum(axis=0) / (2. * _no_axes)
+        values += rng.uniform(-randomization, randomization, size=values.shape)
+        numpy.clip(values, 0., 1., out=values)
+        undefined = grid_cube[_targets] < 0.
+        grid_cube[tuple(_t[undefined] for _t in _targets)] = values[undefined]
 
-        manhattan_diagonal = sum(abs(_a - _b) for _a, _b in zip(*cube))
-        if manhattan_diagonal < 2 * dim:
-            break
 
-        corners = _get_cube_corners(cube)
-        sums = dict()
-        for _d in range(dim):
-            edges = _get_corner_edges(corners, dim - 1)
-            corners.clear()
-            for _each_edge in edges:
-                _midpoint = _get_edge_midpoint(_each_edge)
-                corners.add(_midpoint)
-                value_a = grid_cube[_each_edge[0]]
-                value_b = grid_cube[_each_edge[1]]
-                value_interpolated = (value_a + value_b) / 2.
-                sums[_midpoint] = sums.get(_midpoint, 0.) + value_interpolated
-            for _point, _value in sums.items():
-                value = grid_cube[_point]
-                if value < 0.:
-                    grid_cube[_point] = _randomize(_value / (_d + 1), randomization)
-            sums.clear()
-
-
-def _set_midpoints(grid: numpy.ndarray, tile_size: int, randomization: float, _i: int, wrap: Optional[Sequence[int]] = None, recurse: bool = True):
-    if wrap is None:
-        wrap = tuple()
+def _sync_wrap(grid: numpy.ndarray, wrap: Sequence[int]):
+    # wrapped axes carry a copy of their first slice at the end
+    for _d in wrap:
+        first = tuple(0 if _j == _d else slice(None) for _j in range(grid.ndim))
+        last = tuple(-1 if _j == _d else slice(None) for _j in range(grid.ndim))
+        grid[last] = grid[first]
 
+
+def _set_midpoints(grid: numpy.ndarray, tile_size: int, randomization: float, rng: numpy.random.Generator, wrap: Sequence[int], scratch_values: numpy.ndarray, scratch_noise: numpy.ndarray) -> int:
+    # one level over all cubicles at once: points half way along the axes in a subset, in order of subset size,
+    # are the mean of their two neighbours along each of these axes
+    dim = grid.ndim
+    half = tile_size // 2
+    cells = 0
+    for _no_axes in range(1, dim + 1):
+        for _axes in itertools.combinations(range(dim), _no_axes):
+            slices_target = tuple(slice(half, None, tile_size) if _j in _axes else slice(None, None, tile_size) for _j in range(dim))
+            target = grid[slices_target]
+            size = target.size
+            values = scratch_values[:size].reshape(target.shape)
+            noise = scratch_noise[:size].reshape(target.shape)
+
+            values.fill(0.)
+            for _i in _axes:
+                slices_a = tuple(slice(None, -1, tile_size) if _j == _i else _s for _j, _s in enumerate(slices_target))
+                slices_b = tuple(slice(tile_size, None, tile_size) if _j == _i else _s for _j, _s in enumerate(slices_target))
+                values += grid[slices_a]
+                values += grid[slices_b]
+            values *= .5 / _no_axes
+
+            rng.random(out=noise, dtype=noise.dtype)
+            noise *= 2. * randomization
+            noise -= randomization
+            values += noise
+            numpy.clip(values, 0., 1., out=values)
+            numpy.copyto(target, values, where=target < 0.)
+            cells += size
+
+            _sync_wrap(grid, wrap)
+
+    return cells
+
+
+def _noise_levels(grid: numpy.ndarray, size_cubicles: int, randomization: float, wrap: Sequence[int], rng: numpy.random.Generator, progress: Optional[Progress] = None):
+    # in place, every axis of grid is a multiple of size_cubicles plus its end point
     dim = grid.ndim
+    dtype = grid.dtype
+    _sync_wrap(grid, wrap)
+
+    mask = grid[tuple(slice(None, None, size_cubicles) for _ in range(dim))]
+    numpy.copyto(mask, rng.random(mask.shape), where=mask < 0.)
+    _sync_wrap(grid, wrap)
 
-    offset = int(recurse) * tile_size // 2
+    # scratch memory for the largest subset of the finest level, all others use the beginning of it
+    size_scratch = reduce(lambda _x, _y: _x * _y, ((_s - 1) // 2 + 1 for _s in grid.shape), 1)
+    scratch_values = numpy.empty(size_scratch, dtype=dtype)
+    scratch_noise = numpy.empty(size_scratch, dtype=dtype)
+
+    with ProgressPhase(progress, "levels", total=int(math.log2(size_cubicles))) as phase:
+        tile_size = size_cubicles
+        while 2 <= tile_size:
+            cells = _set_midpoints(grid, tile_size, randomization, rng, wrap, scratch_values, scratch_noise)
+            phase.advance(cells=cells)
+            tile_size //= 2
+
+
+def _create_noise_levels(grid: numpy.ndarray, size_cubicles: int, randomization: float, wrap: Sequence[int], rng: Optional[numpy.random.Generator] = None, progress: Optional[Progress] = None) -> numpy.ndarray:
+    shape = grid.shape
+    if rng is None:
+        rng = numpy.random.default_rng(random.getrandbits(64))
 
-    slices_source_a = tuple(slice(None, -tile_size, tile_size) if _j == _i else slice(None, None, tile_size) for _j in range(dim))
-    view_a = grid[slices_source_a]
+    # every axis gets an end point, a copy of the start on wrapped axes
+    dtype = numpy.float32 if grid.dtype == numpy.float32 else numpy.float64
+    padded = numpy.full(tuple(_s + 1 for _s in shape), -1., dtype=dtype)
+    padded[tuple(slice(None, _s) for _s in shape)] = grid
+    _noise_levels(padded, size_cubicles, randomization, wrap, rng, progress=progress)
 
-    slices_source_b = tuple(slice(tile_size, None, tile_size) if _j == _i else slice(None, None, tile_size) for _j in range(dim))
-    view_b = grid[slices_source_b]
+    return padded[tuple(slice(None, _s) for _s in shape)]
 
-    slices_target = tuple(slice(tile_size // 2, None, tile_size) if _j == _i else slice(None, None, tile_size) for _j in range(dim))
-    grid[slices_target] = (view_a + view_b) / 2. + (2. * numpy.random.random(view_a.shape) - 1.) * randomization
 
-    if not recurse:
-        return
+# grid of a worker process, attached once by name from shared memory
+_worker_grid = dict()  # type: Dict[str, Any]
 
-    for _j in range(dim):
-        if _i == _j:
-            continue
-        _set_midpoints(grid, tile_size // 2, randomization, _j, recurse=False)
 
+def _attach_grid(name: str, shape: Tuple[int, ...], dtype: str, size_cubicles: int, randomization: float):
+    memory = shared_memory.SharedMemory(name=name)
+    _worker_grid["memory"] = memory
+    _worker_grid["grid"] = numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=memory.buf)
+    _worker_grid["size_cubicles"] = size_cubicles
+    _worker_grid["randomization"] = randomization
 
-def create_noise(grid: numpy.ndarray, size_cubicles: int, randomization: float, wrap: Optional[Sequence[int]] = None) -> numpy.ndarray:
+
+def _noise_interior(corner: Tuple[int, ...], seed: int):
+    # the faces of the cubicle are defined, so only its interior is written
+    size_cubicles = _worker_grid["size_cubicles"]
+    cube = _worker_grid["grid"][tuple(slice(_c, _c + size_cubicles + 1) for _c in corner)]
+    _noise_levels(cube, size_cubicles, _worker_grid["randomization"], tuple(), numpy.random.default_rng(seed))
+
+
+def _noise_faces(grid: numpy.ndarray, size_cubicles: int, randomization: float, wrap: Sequence[int], rng: numpy.random.Generator, progress: Optional[Progress] = None):
+    # every hyperplane between cubicles is a grid of one dimension less, the ends of wrapped axes are copies
+    dim = grid.ndim
+    no_planes = sum(len(range(0, _s - int(_d in wrap), size_cubicles)) for _d, _s in enumerate(grid.shape))
+    with ProgressPhase(progress, "faces", total=no_planes) as phase:
+        for _d in range(dim):
+            wrap_plane = tuple(_j - int(_d < _j) for _j in wrap if _j != _d)
+            stop = grid.shape[_d] - int(_d in wrap)
+            for _k in range(0, stop, size_cubicles):
+                plane = grid[tuple(_k if _j == _d else slice(None) for _j in range(dim))]
+                _noise_levels(plane, size_cubicles, randomization, wrap_plane, rng)
+                phase.advance(cells=plane.size)
+    _sync_wrap(grid, wrap)
+
+
+def create_noise_parallel(
+        grid: numpy.ndarray, size_cubicles: int, randomization: float, wrap: Optional[Sequence[int]] = None,
+        max_workers: Optional[int] = None, progress: Optional[Progress] = None) -> numpy.ndarray:
+    # faces first, then the independent cubicle interiors in worker processes that share the grid memory
+    if wrap is None:
+        wrap = tuple()
+    shape = grid.shape
+    dim = grid.ndim
+    assert all(_s % size_cubicles == 0 for _s in shape)
+    rng = numpy.random.default_rng(random.getrandbits(64))
+
+    dtype = numpy.dtype(numpy.float32 if grid.dtype == numpy.float32 else numpy.float64)
+    shape_padded = tuple(_s + 1 for _s in shape)
+    memory = shared_memory.SharedMemory(create=True, size=reduce(lambda _x, _y: _x * _y, shape_padded, 1) * dtype.itemsize)
+    try:
+        padded = numpy.ndarray(shape_padded, dtype=dtype, buffer=memory.buf)
+        padded.fill(-1.)
+        padded[tuple(slice(None, _s) for _s in shape)] = grid
+        _sync_wrap(padded, wrap)
+
+        mask = padded[tuple(slice(None, None, size_cubicles) for _ in range(dim))]
+        numpy.copyto(mask, rng.random(mask.shape), where=mask < 0.)
+        _sync_wrap(padded, wrap)
+
+        _noise_faces(padded, size_cubicles, randomization, wrap, rng, progress=progress)
+
+        corners = list(itertools.product(*(range(0, _s, size_cubicles) for _s in shape)))
+        seeds = [random.getrandbits(64) for _ in corners]
+        initargs = memory.name, shape_padded, dtype.str, size_cubicles, randomization
+        no_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        chunksize = max(1, len(corners) // (4 * no_workers))
+        cells_cubicle = size_cubicles ** dim
+        with ProcessPoolExecutor(max_workers=no_workers, initializer=_attach_grid, initargs=initargs) as executor, \
+                ProgressPhase(progress, "interiors", total=len(corners)) as phase:
+            for _ in executor.map(_noise_interior, corners, seeds, chunksize=chunksize):
+                phase.advance(cells=cells_cubicle)
+
+        # wrapped ends were faces, interiors never reach them
+        return padded[tuple(slice(None, _s) for _s in shape)].copy()
+
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def open_volume(path: str, shape: Sequence[int], dtype: numpy.dtype = numpy.float32) -> numpy.memmap:
+    # .npy file with an end point on every axis and all cells undefined, written slice by slice
+    volume = numpy.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=tuple(_s + 1 for _s in shape))
+    for _each_slice in volume:
+        _each_slice.fill(-1.)
+    volume.flush()
+    return volume
+
+
+def create_noise_out_of_core(
+        volume: numpy.memmap, size_cubicles: int, randomization: float, wrap: Optional[Sequence[int]] = None,
+        size_chunk: Optional[int] = None, progress: Optional[Progress] = None) -> numpy.ndarray:
+    # volume comes from open_volume and may hold seeds, chunks are filled in C order so only one chunk is in memory
+    # and the faces it shares with chunks done before are read back from the file
+    if wrap is None:
+        wrap = tuple()
+    if size_chunk is None:
+        size_chunk = size_cubicles
+    dim = volume.ndim
+    shape = tuple(_s - 1 for _s in volume.shape)
+    assert size_chunk % size_cubicles == 0
+    assert all(_s % size_chunk == 0 for _s in shape)
+    rng = numpy.random.default_rng(random.getrandbits(64))
+
+    chunks = array_windows(volume, tuple(size_chunk + 1 for _ in range(dim)), step=tuple(size_chunk for _ in range(dim)))
+    cells_chunk = size_chunk ** dim
+    with ProgressPhase(progress, "chunks", total=reduce(lambda _x, _y: _x * _y, chunks.shape[:dim], 1)) as phase:
+        for _chunk in numpy.ndindex(*chunks.shape[:dim]):
+            corner = tuple(_c * size_chunk for _c in _chunk)
+            slices = tuple(slice(_c, _c + size_chunk + 1) for _c in corner)
+            block = numpy.array(chunks[_chunk])
+
+            # the end of a wrapped axis is its start, which an earlier chunk already filled
+            for _d in wrap:
+                if corner[_d] + size_chunk == shape[_d]:
+                    start = tuple(0 if _j == _d else _s for _j, _s in enumerate(slices))
+                    end = tuple(-1 if _j == _d else slice(None) for _j in range(dim))
+                    block[end] = volume[start]
+
+            _noise_levels(block, size_cubicles, randomization, tuple(), rng)
+            chunks[_chunk] = block
+            phase.advance(cells=cells_chunk)
+
+    volume.flush()
+    return volume[tuple(slice(None, _s) for _s in shape)]
+
+
+def stream_noise(
+        shape_layer: Sequence[int], size_cubicles: int, randomization: float, depth: Optional[int] = None,
+        wrap: Optional[Sequence[int]] = None, sub_volumes: bool = False) -> Generator[numpy.ndarray, None, None]:
+    # endless layers along a new first axis, wrap refers to the layer axes. chunks of depth layers are generated one
+    # ahead in the background, only the last layer of a chunk is carried over as the first of the next one
+    if depth is None:
+        depth = size_cubicles
+    assert depth % size_cubicles == 0
+    assert all(_s % size_cubicles == 0 for _s in shape_layer)
+
+    wrap_volume = tuple() if wrap is None else tuple(_d + 1 for _d in wrap)
+    shape_chunk = (depth + 1, ) + tuple(_s + 1 for _s in shape_layer)
+    crop = (slice(None, depth), ) + tuple(slice(None, _s) for _s in shape_layer)
+    rng = numpy.random.default_rng(random.getrandbits(64))
+
+    def generate(carried: Optional[numpy.ndarray]) -> numpy.ndarray:
+        chunk = numpy.full(shape_chunk, -1.)
+        if carried is not None:
+            chunk[0] = carried
+        _noise_levels(chunk, size_cubicles, randomization, wrap_volume, rng)
+        return chunk
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stream")
+    future = None
+    try:
+        future = executor.submit(generate, None)
+        while True:
+            chunk = future.result()
+            future = executor.submit(generate, chunk[-1].copy())
+            volume = chunk[crop]
+            if sub_volumes:
+                yield volume
+            else:
+                yield from volume
+
+    finally:
+        # cancel_futures needs python 3.9, the chunk ahead is cancelled by hand
+        if future is not None:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def create_noise(grid: numpy.ndarray, size_cubicles: int, randomization: float, wrap: Optional[Sequence[int]] = None, per_cubicle: bool = False, progress: Optional[Progress] = None) -> numpy.ndarray:
     # check
     assert is_power_two(size_cubicles)
     shape = grid.shape
@@ -230,6 +399,9 @@ def create_noise(grid: numpy.ndarray, size_cubicles: int, randomization: float,
     for each_dimension in shape:
         assert each_dimension % size_cubicles == 0
 
+    if not per_cubicle:
+        return _create_noise_levels(grid, size_cubicles, randomization, wrap, progress=progress)
+
     # initialize
     shape_cubicles = tuple(each_dimension // size_cubicles for each_dimension in shape)
     no_cubicles_total = reduce(lambda _x, _y: _x * _y, shape_cubicles, 1)
@@ -241,42 +413,23 @@ def create_noise(grid: numpy.ndarray, size_cubicles: int, randomization: float,
     mask = grid[tuple(slice(None, None, size_cubicles) for _ in range(dim))]
     numpy.place(mask, mask < 0., scaffold)
 
-    """
-    current_size = size_cubicles
-    while current_size >= 1:
-        for _d in range(dim):
-            _set_midpoints(grid, current_size, randomization, _d)
+    # cubes of unwrapped grids are views, otherwise cubes at the end are gathered and written back
+    cubes = None
+    if len(wrap) < 1:
+        cubes = array_windows(grid, tuple(size_cubicles + 1 for _ in range(dim)), step=tuple(size_cubicles for _ in range(dim)))
 
-        current_size //= 2
+    cells_cubicle = size_cubicles ** dim
+    with ProgressPhase(progress, "cubicles", total=no_cubicles_total) as phase:
+        for _tile_coordinate in itertools.product(*tuple(range(_s) for _s in shape_cubicles)):
+            if cubes is not None:
+                _noise_cube(cubes[_tile_coordinate], randomization)
+            else:
+                index = _cube_index(grid.shape, tuple(_c * size_cubicles for _c in _tile_coordinate), size_cubicles)
+                grid_cube = grid[index]
+                _noise_cube(grid_cube, randomization)
+                grid[index] = grid_cube
 
-    """
-
-    no_cubes_done = 0
-    for _tile_coordinate in itertools.product(*tuple(range(_s) for _s in shape_cubicles)):
-        indices = tuple(
-            zip(
-                *itertools.product(
-                    *tuple(
-                        tuple(
-                            (_x + _c * size_cubicles) % (size + int(_d not in wrap))
-                            for _x in range(size_cubicles + 1)
-                        )
-                        for _d, _c in enumerate(_tile_coordinate)
-                    )
-                )
-            )
-        )
-
-        grid_cube = grid[indices].reshape(tuple(size_cubicles + 1 for _ in grid.shape))
-
-        _noise_cube(grid_cube, randomization)
-
-        grid[indices] = grid_cube.flatten()
-
-        no_cubes_done += 1
-        print(f"finished {no_cubes_done:d} of {no_cubicles_total:d} tiles...")
-
-    #"""
+            phase.advance(cells=cells_cubicle)
 
     return grid[tuple(slice(None, _s, None) for _s in shape)]
 
@@ -308,37 +461,17 @@ def noise_cubed_infinite():
     # http://fdg2020.org/
     size = 16
 
-    noised = numpy.full((size, size, size), -1.)
-
-    while True:
-        _i = 0
-
-        # xing(noised)
-        # cross(noised[-1])
-
-        noised = create_noise(noised, size // 4, size / 1024., wrap=None)
-
-        for _each_layer in noised[1:]:
-            pyplot.clf()
-            print(f"layer {_i:d}")
-            draw(_each_layer)
-            pyplot.pause(.25)
-            _i = (_i + 1) % size
-
-        noised[0] = noised[-1]
-
-        noised[1:] = numpy.full((size - 1, size, size), -1.)
-
-    pyplot.show()
+    for _i, _each_layer in enumerate(stream_noise((size, size), size // 4, size / 1024., depth=size)):
+        pyplot.clf()
+        print(f"layer {_i % size:d}")
+        draw(_each_layer)
+        pyplot.pause(.25)
 
 
 def bi_cross(grid: numpy.ndarray):
     assert grid.ndim == 2
     height, width = grid.shape
-    for _y, row in enumerate(grid):
-        for _x, value in enumerate(row):
-            if width // 2 - width * .05 < _x < width // 2 + width * .05 or height // 2 - height * .05 < _y < height // 2 + height * .05:
-                row[_x] = float(_x >= _y)
+    stamp_cross(grid, (height // 2, width // 2), (height * .05, width * .05), value=lambda _y, _x: _x >= _y)
 
 
 def noise_cubed():
@@ -436,6 +569,14 @@ def noise_squared():
     pyplot.show()
 
 
+def _benchmark_levels(size: int = 256, size_cubicles: int = 64, dim: int = 3):
+    grid = numpy.full(tuple(size for _ in range(dim)), -1.)
+    time_start = time.perf_counter()
+    noised = create_noise(grid, size_cubicles, size / 1024., wrap=[0])
+    duration = time.perf_counter() - time_start
+    print(f"levels: {duration:.2f} s for {size:d}^{dim:d}, values from {noised.min():.3f} to {noised.max():.3f}")
+
+
 def main():
     # noise_squared()
     # noise_cubed_infinite()
@@ -1,7 +1,8 @@
 import math
 import random
 import itertools
-from typing import Sequence
+import time
+from typing import Sequence, Optional, Callable
 
 import numpy
 from PIL import Image
@@ -41,6 +42,37 @@ def _rectangle(im: Image, x: int, y: int, size: int):
                 im.putpixel((x + size, _v + y), 255)
 
 
+def _fill_undefined(target: numpy.ndarray, values: numpy.ndarray, randomization: int, value_min: int, value_max: int, random_integers: Callable[..., numpy.ndarray]):
+    undefined = target == 0
+    no_undefined = numpy.count_nonzero(undefined)
+    if no_undefined < 1:
+        return
+    randomized = values[undefined] + random_integers(-randomization, randomization + 1, size=no_undefined)
+    target[undefined] = numpy.clip(randomized, value_min, value_max)
+
+
+def _noise_region(region: numpy.ndarray, window: int, randomization: int, value_min: int, value_max: int, random_integers: Callable[..., numpy.ndarray]):
+    # region[y, x] spans whole windows plus its end points, zero marks undefined cells
+    corners = region[::window, ::window]
+    undefined = corners == 0
+    corners[undefined] = random_integers(value_min, value_max + 1, size=numpy.count_nonzero(undefined))
+
+    while 1 < window:
+        half = window // 2
+        corners = region[::window, ::window].astype(numpy.int32)
+
+        values_vertical = (corners[:-1, :] + corners[1:, :]) // 2
+        _fill_undefined(region[half::window, ::window], values_vertical, randomization, value_min, value_max, random_integers)
+
+        values_horizontal = (corners[:, :-1] + corners[:, 1:]) // 2
+        _fill_undefined(region[::window, half::window], values_horizontal, randomization, value_min, value_max, random_integers)
+
+        values_center = (corners[:-1, :-1] + corners[:-1, 1:] + corners[1:, 1:] + corners[1:, :-1]) // 4
+        _fill_undefined(region[half::window, half::window], values_center, randomization, value_min, value_max, random_integers)
+
+        window = half
+
+
 class Tile:
     def __init__(self, size: int, grid_size: int = 64, randomization: int = 50, value_min: int = 1, value_max: int = 255):
         assert is_power_two(size - 1)
@@ -50,7 +82,11 @@ class Tile:
         self._max = value_max
         self._randomization = randomization
 
-        self._grid = [[0 for _ in range(size)] for _ in range(size)]
+        self._grid = numpy.zeros((size, size), dtype=numpy.uint8 if value_max < 256 else numpy.int32)
+
+    @property
+    def grid(self) -> numpy.ndarray:
+        return self._grid
 
     def draw(self, skip_render: bool = True):
         image = Image.fromarray(numpy.uint8(self._grid), "L")
@@ -71,12 +107,10 @@ class Tile:
         if not self._size > y >= 0:
             assert False
 
-        row = self._grid[y]
-        return row[x]
+        return int(self._grid[y, x])
 
     def delete(self, x: int, y: int):
-        row = self._grid[y]
-        row[x] = 0
+        self._grid[y, x] = 0
 
     def set(self, x: int, y: int, value: int, overwrite: bool = True):
         if not self._size > x >= 0:
@@ -89,11 +123,7 @@ class Tile:
         if not overwrite and 0 < self.get(x, y):
             return
 
-        try:
-            row = self._grid[y]
-            row[x] = value
-        except TypeError:
-            assert False
+        self._grid[y, x] = value
 
     def _randomize(self, value: int, r: int) -> int:
         #value_r = value + random.randint(-r, r)
@@ -141,7 +171,11 @@ class Tile:
             value_w = (value_sw + value_nw) // 2
             self.set(x_origin, y_mid, self._randomize(value_w, r), overwrite=False)
 
-    def create_noise(self, x_offset: int = 0, y_offset: int = 0):
+    def create_noise(self, x_offset: int = 0, y_offset: int = 0, vectorized: bool = True, rng: Optional[numpy.random.Generator] = None):
+        if vectorized:
+            self._create_noise_region(x_offset, y_offset, rng)
+            return
+
         window = self._grid_size
         while 1 < window:
 
@@ -171,6 +205,23 @@ class Tile:
 
             window //= 2
 
+    def _create_noise_region(self, x_offset: int, y_offset: int, rng: Optional[numpy.random.Generator]):
+        # only the windows around undefined cells are filled, aligned to the largest window from the offsets
+        window = self._grid_size
+        y_to = y_offset + (self._size - 1 - y_offset) // window * window
+        x_to = x_offset + (self._size - 1 - x_offset) // window * window
+        covered = self._grid[y_offset:y_to + 1, x_offset:x_to + 1]
+        undefined = covered == 0
+        rows = numpy.flatnonzero(undefined.any(axis=1))
+        if len(rows) < 1:
+            return
+        columns = numpy.flatnonzero(undefined.any(axis=0))
+
+        y_first, y_last = rows[0] // window * window, -(-rows[-1] // window) * window
+        x_first, x_last = columns[0] // window * window, -(-columns[-1] // window) * window
+        random_integers = numpy.random.randint if rng is None else rng.integers
+        _noise_region(covered[y_first:y_last + 1, x_first:x_last + 1], window, self._randomization, self._min, self._max, random_integers)
+
     def _get_neighbors(self, x: int, y: int) -> Sequence[int]:
         neighbors = itertools.product((-1, 0, 1), repeat=2)
         neighbor_values= []
@@ -219,47 +270,27 @@ class Map:
         self._tile_current.create_noise()
 
     def move_north(self):
-        for x in range(self._tile_size):
-            for y in range(self._tile_size - self._offset - 1, -1, -1):
-                value = self._tile_current.get(x, y)
-                self._tile_current.set(x, y + self._offset, value, overwrite=True)
-
-            for y in range(self._offset):
-                self._tile_current.delete(x, y)
-
+        grid = self._tile_current.grid
+        grid[self._offset:, :] = grid[:self._tile_size - self._offset, :]
+        grid[:self._offset, :] = 0
         self._tile_current.create_noise()
 
     def move_east(self):
-        for y in range(self._tile_size):
-            for x in range(self._offset, self._tile_size):
-                value = self._tile_current.get(x, y)
-                self._tile_current.set(x - self._offset, y, value, overwrite=True)
-
-            for x in range(self._tile_size - self._offset, self._tile_size):
-                self._tile_current.delete(x, y)
-
+        grid = self._tile_current.grid
+        grid[:, :self._tile_size - self._offset] = grid[:, self._offset:]
+        grid[:, self._tile_size - self._offset:] = 0
         self._tile_current.create_noise()
 
     def move_south(self):
-        for x in range(self._tile_size):
-            for y in range(self._offset, self._tile_size):
-                value = self._tile_current.get(x, y)
-                self._tile_current.set(x, y - self._offset, value, overwrite=True)
-
-            for y in range(self._tile_size - self._offset, self._tile_size):
-                self._tile_current.delete(x, y)
-
+        grid = self._tile_current.grid
+        grid[:self._tile_size - self._offset, :] = grid[self._offset:, :]
+        grid[self._tile_size - self._offset:, :] = 0
         self._tile_current.create_noise()
 
     def move_west(self):
-        for y in range(self._tile_size):
-            for x in range(self._tile_size - self._offset - 1, -1, -1):
-                value = self._tile_current.get(x, y)
-                self._tile_current.set(x + self._offset, y, value)
-
-            for x in range(self._offset):
-                self._tile_current.delete(x, y)
-
+        grid = self._tile_current.grid
+        grid[:, self._offset:] = grid[:, :self._tile_size - self._offset]
+        grid[:, :self._offset] = 0
         self._tile_current.create_noise()
 
     def zoom_in(self, ratio: float = .5):
@@ -338,6 +369,18 @@ def main():
     pyplot.show()
 
 
+def _benchmark_move(size: int = 512, repetitions: int = 20):
+    map_tiles = Map(tile_size=size + 1, grid_size=size // 8, offset=size // 8, randomization=size // 8)
+    moves = map_tiles.move_north, map_tiles.move_east, map_tiles.move_south, map_tiles.move_west
+    durations = []
+    for _i in range(repetitions):
+        time_start = time.perf_counter()
+        moves[_i % len(moves)]()
+        durations.append(time.perf_counter() - time_start)
+    print(f"move: {min(durations) * 1000.:.1f} ms for map size {size + 1:d}")
+
+
 if __name__ == "__main__":
     random.seed(2346464)
+    numpy.random.seed(2346464)
     main()
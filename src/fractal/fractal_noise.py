@@ -1,27 +1,71 @@
+import hashlib
+import math
+import os
 import random
+import struct
+import tempfile
+import threading
 import time
-from typing import Optional, Tuple, Sequence
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from typing import Optional, Tuple, Sequence, Callable, Dict, Set, List, Iterable, Union, Iterator
 
 import numpy
 from PIL import Image
 from PIL import ImageFilter
 from matplotlib import pyplot
 
+from src.fractal.world_store import WorldStore
+from src.tools import Progress, ProgressPhase
+
 
 def _render(image: Image, skip: bool = False) -> Image:
-    rendered = image.copy()
-    width, height = rendered.size
+    data = numpy.array(image)
+    height, width = data.shape
     if not skip:
         filtered_a = image.filter(ImageFilter.GaussianBlur(radius=2))
         # filtered_a = filtered_a.filter(ImageFilter.CONTOUR)
         filtered_b = image.filter(ImageFilter.GaussianBlur(radius=3))
-        data_a = numpy.array(filtered_a)
-        data_b = numpy.array(filtered_b)
-        for row_a, row_b in zip(data_a, data_b):
-            for i, value_b in enumerate(row_b):
-                if value_b < 92:
-                    row_a[i] = 1
-        rendered = Image.fromarray(data_a, mode="L")
+        data = numpy.array(filtered_a)
+        data[numpy.array(filtered_b) < 92] = 1
+    _rectangle(data, width // 4, height // 4, width // 2)
+    return Image.fromarray(data, mode="L")
+
+
+def _blur(data: numpy.ndarray, radius: float) -> numpy.ndarray:
+    # separable gaussian with edge extension, radius is the standard deviation like in PIL
+    reach = max(1, int(math.ceil(3. * radius)))
+    kernel = numpy.exp(-.5 * (numpy.arange(-reach, reach + 1) / radius) ** 2.)
+    kernel /= kernel.sum()
+
+    blurred = data.astype(numpy.float32)
+    for _axis in range(2):
+        padding = tuple((reach, reach) if _a == _axis else (0, 0) for _a in range(2))
+        padded = numpy.pad(blurred, padding, mode="edge")
+        length = blurred.shape[_axis]
+
+        def shifted(offset: int) -> numpy.ndarray:
+            return padded[tuple(slice(offset, offset + length) if _a == _axis else slice(None) for _a in range(2))]
+
+        # the kernel is symmetric, pairs of taps share one multiplication
+        blurred = shifted(reach) * numpy.float32(kernel[reach])
+        paired = numpy.empty_like(blurred)
+        for _k in range(reach):
+            numpy.add(shifted(_k), shifted(2 * reach - _k), out=paired)
+            paired *= numpy.float32(kernel[_k])
+            blurred += paired
+    return blurred
+
+
+def _render_array(data: numpy.ndarray, skip: bool = False) -> numpy.ndarray:
+    height, width = data.shape
+    if skip:
+        rendered = data.copy()
+    else:
+        rendered = numpy.uint8(numpy.rint(_blur(data, 2.)))
+        rendered[_blur(data, 3.) < 92] = 1
     _rectangle(rendered, width // 4, height // 4, width // 2)
     return rendered
 
@@ -30,55 +74,121 @@ def is_power_two(n: int) -> bool:
     return n and (not(n & (n - 1)))
 
 
-def _rectangle(im: Image, x: int, y: int, size: int):
-    width, height = im.size
-    for _v in range(size):
-        if _v + x < width:
-            im.putpixel((_v + x, y), 255)
-            if y + size < height:
-                im.putpixel((_v + x, y + size), 255)
-        if _v + y < height:
-            im.putpixel((x, _v + y), 255)
-            if x + size < width:
-                im.putpixel((x + size, _v + y), 255)
+def _rectangle(data: numpy.ndarray, x: int, y: int, size: int):
+    height, width = data.shape
+    data[y, x:x + size] = 255
+    if y + size < height:
+        data[y + size, x:x + size] = 255
+    data[y:y + size, x] = 255
+    if x + size < width:
+        data[y:y + size, x + size] = 255
+
+
+def _tile_rng(seed: int, level: int, x: int, y: int) -> numpy.random.Generator:
+    digest = hashlib.blake2b(struct.pack("<4q", seed, level, x, y), digest_size=16).digest()
+    return numpy.random.default_rng(int.from_bytes(digest, "little"))
+
+
+def _fill_undefined(target: numpy.ndarray, values: numpy.ndarray, randomization: int, value_min: int, value_max: int, random_integers: Callable[..., numpy.ndarray]):
+    undefined = target == 0
+    no_undefined = numpy.count_nonzero(undefined)
+    if no_undefined < 1:
+        return
+    randomized = values[undefined] + random_integers(-randomization, randomization + 1, size=no_undefined)
+    target[undefined] = numpy.clip(randomized, value_min, value_max)
+
+
+def _noise_array(grid: numpy.ndarray, randomization: int, value_min: int, value_max: int, rng: Optional[numpy.random.Generator] = None):
+    # grid[y, x] of shape (size + 1, size + 1), zero marks undefined cells
+    size = grid.shape[0] - 1
+    assert grid.shape == (size + 1, size + 1)
+    assert is_power_two(size)
+
+    random_integers = numpy.random.randint if rng is None else rng.integers
+
+    corners = grid[::size, ::size]
+    undefined = corners == 0
+    corners[undefined] = random_integers(value_min, value_max + 1, size=numpy.count_nonzero(undefined))
+
+    window = size
+    while 1 < window:
+        half = window // 2
+        corners = grid[::window, ::window].astype(numpy.int32)
+
+        values_vertical = (corners[:-1, :] + corners[1:, :]) // 2
+        _fill_undefined(grid[half::window, ::window], values_vertical, randomization, value_min, value_max, random_integers)
+
+        values_horizontal = (corners[:, :-1] + corners[:, 1:]) // 2
+        _fill_undefined(grid[::window, half::window], values_horizontal, randomization, value_min, value_max, random_integers)
 
+        values_center = (corners[:-1, :-1] + corners[:-1, 1:] + corners[1:, 1:] + corners[1:, :-1]) // 4
+        _fill_undefined(grid[half::window, half::window], values_center, randomization, value_min, value_max, random_integers)
 
-class Corner:
-    def __init__(self, value: int):
-        self.value = value
+        window = half
 
 
-class Edge:
-    def __init__(self, size: int):
-        self.values = [0] * size
+def _check_values(value_min: int, value_max: int):
+    # cells are stored as uint8 and zero marks undefined cells
+    if not 1 <= value_min <= value_max <= 255:
+        raise ValueError(f"values must satisfy 1 <= value_min <= value_max <= 255, not {value_min:d} and {value_max:d}")
 
 
 class Tile:
     def __init__(self, size: int, randomization: int = 50, value_min: int = 1, value_max: int = 255):
         assert is_power_two(size)
+        _check_values(value_min, value_max)
         self._size = size
         self._min = value_min
         self._max = value_max
         self._randomization = randomization
 
-        self._grid = [[0 for _ in range(size - 1)] for _ in range(size - 1)]
+        # grid[y, x], zero marks undefined cells
+        self._grid = numpy.zeros((size + 1, size + 1), dtype=numpy.uint8)
 
-        self.edge_north = Edge(size - 1)
-        self.edge_east = Edge(size - 1)
-        self.edge_south = Edge(size - 1)
-        self.edge_west = Edge(size - 1)
+    @property
+    def grid(self) -> numpy.ndarray:
+        return self._grid
 
-        self.corner_northwest = Corner(0)
-        self.corner_northeast = Corner(0)
-        self.corner_southeast = Corner(0)
-        self.corner_southwest = Corner(0)
+    @property
+    def edge_north(self) -> numpy.ndarray:
+        return self._grid[0, :]
 
-    def draw(self, skip_render: bool = True):
+    @property
+    def edge_east(self) -> numpy.ndarray:
+        return self._grid[:, -1]
+
+    @property
+    def edge_south(self) -> numpy.ndarray:
+        return self._grid[-1, :]
+
+    @property
+    def edge_west(self) -> numpy.ndarray:
+        return self._grid[:, 0]
+
+    @property
+    def corner_northwest(self) -> numpy.ndarray:
+        return self._grid[:1, :1]
+
+    @property
+    def corner_northeast(self) -> numpy.ndarray:
+        return self._grid[:1, -1:]
+
+    @property
+    def corner_southeast(self) -> numpy.ndarray:
+        return self._grid[-1:, -1:]
+
+    @property
+    def corner_southwest(self) -> numpy.ndarray:
+        return self._grid[-1:, :1]
+
+    def draw(self, skip_render: bool = True, blur_separable: bool = False):
         #pyplot.ion()
 
-        window = [[self.corner_northwest.value] + self.edge_north.values] + [[self.edge_west.values[_y]] + row for _y, row in enumerate(self._grid)]
-        image = Image.fromarray(numpy.uint8(window), "L")
-        image = _render(image, skip=skip_render)
+        if blur_separable:
+            image = _render_array(self._grid[:-1, :-1], skip=skip_render)
+        else:
+            image = Image.fromarray(self._grid[:-1, :-1], "L")
+            image = _render(image, skip=skip_render)
 
         #pyplot.pause(.00000001)
 
@@ -99,61 +209,17 @@ class Tile:
         assert self._size >= x >= 0
         assert self._size >= y >= 0
 
-        if x == 0:
-            if y == 0:
-                return self.corner_northwest.value
-            if y == self._size:
-                return self.corner_southwest.value
-            return self.edge_west.values[y - 1]
-
-        if x == self._size:
-            if y == 0:
-                return self.corner_northeast.value
-            if y == self._size:
-                return self.corner_southeast.value
-            return self.edge_east.values[y - 1]
-
-        if y == 0:
-            return self.edge_north.values[x - 1]
-
-        if y == self._size:
-            return self.edge_south.values[x - 1]
-
-        return self._grid[y - 1][x - 1]
+        return int(self._grid[y, x])
 
     def set(self, x: int, y: int, value: int, overwrite: bool = True):
         assert self._size >= x >= 0
         assert self._size >= y >= 0
         assert self._max >= value >= self._min
 
-        if not overwrite and 0 < self.get(x, y):
+        if not overwrite and 0 < self._grid[y, x]:
             return
 
-        if x == 0:
-            if y == 0:
-                self.corner_northwest.value = value
-            elif y == self._size:
-                self.corner_southwest.value = value
-            else:
-                self.edge_west.values[y - 1] = value
-
-        elif x == self._size:
-            if y == 0:
-                self.corner_northeast.value = value
-            elif y == self._size:
-                self.corner_southeast.value = value
-            else:
-                self.edge_east.values[y - 1] = value
-
-        elif y == 0:
-            self.edge_north.values[x - 1] = value
-
-        elif y == self._size:
-            self.edge_south.values[x - 1] = value
-
-        else:
-            row = self._grid[y - 1]
-            row[x - 1] = value
+        self._grid[y, x] = value
 
     def _randomize(self, value: int, r: int) -> int:
         #value_r = value + random.randint(-r, r)
@@ -201,7 +267,11 @@ class Tile:
             value_w = (value_sw + value_nw) // 2
             self.set(x_origin, y_mid, self._randomize(value_w, r), overwrite=False)
 
-    def create_noise(self):
+    def create_noise(self, vectorized: bool = True, rng: Optional[numpy.random.Generator] = None):
+        if vectorized:
+            _noise_array(self._grid, self._randomization, self._min, self._max, rng=rng)
+            return
+
         value_nw = random.randint(self._min, self._max)
         self.set(0, 0, value_nw, overwrite=False)
 
@@ -224,16 +294,11 @@ class Tile:
 
     def stretch(self, east: bool, south: bool) -> "Tile":
         edge_zoom = self._size // 2
+        _x_source = int(east) * edge_zoom
+        _y_source = int(south) * edge_zoom
 
         tile_expand = self.new()
-
-        for _x in range(0, self._size + 1, 2):
-            _x_source = _x // 2 + int(east) * edge_zoom
-            for _y in range(0, self._size + 1, 2):
-                _y_source = _y // 2 + int(south) * edge_zoom
-                value = self.get(_x_source, _y_source)
-                tile_expand.set(_x, _y, value)
-
+        tile_expand._grid[::2, ::2] = self._grid[_y_source:_y_source + edge_zoom + 1, _x_source:_x_source + edge_zoom + 1]
         return tile_expand
 
     def shrink(self) -> "Tile":
@@ -243,93 +308,232 @@ class Tile:
             value_min=self._min,
             value_max=self._max)
 
-        for _x in range(tile_shrunk._size + 1):
-            _x_source = _x * 2
-            for _y in range(tile_shrunk._size + 1):
-                _y_source = _y * 2
-                value = self.get(_x_source, _y_source)
-                tile_shrunk.set(_x, _y, value)
-
+        tile_shrunk._grid[:, :] = self._grid[::2, ::2]
         return tile_shrunk
 
     def insert_tile(self, tile: "Tile", x: int = 0, y: int = 0):
-        for _x in range(tile._size + 1):
-            x_total = x + _x
-            if self._size < x_total or x_total < 0:
-                continue
-            for _y in range(tile._size + 1):
-                y_total = y + _y
-                if self._size < y_total or y_total < 0:
-                    continue
-                value = tile.get(_x, _y)
-                if 0 < value:
-                    self.set(x_total, y_total, value)
+        x_from, y_from = max(0, x), max(0, y)
+        x_to, y_to = min(self._size, x + tile._size) + 1, min(self._size, y + tile._size) + 1
+        if x_to <= x_from or y_to <= y_from:
+            return
+
+        source = tile._grid[y_from - y:y_to - y, x_from - x:x_to - x]
+        target = self._grid[y_from:y_to, x_from:x_to]
+        numpy.copyto(target, source, where=0 < source)
+
+
+TILE_KEY = Tuple[int, int, int]
+
+
+class SpillDirectory:
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._temporary = None  # type: Optional[tempfile.TemporaryDirectory]
+        self._keys = set()  # type: Set[TILE_KEY]
+
+    def __enter__(self) -> "SpillDirectory":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        # only a temporary directory is removed, a given path is left as it is
+        if self._temporary is not None:
+            self._temporary.cleanup()
+            self._temporary = None
+            self._path = None
+        self._keys.clear()
+
+    def _file_path(self, key: TILE_KEY) -> str:
+        if self._path is None:
+            self._temporary = tempfile.TemporaryDirectory(prefix="fractal_tiles_")
+            self._path = self._temporary.name
+        else:
+            os.makedirs(self._path, exist_ok=True)
+        level, x, y = key
+        return os.path.join(self._path, f"{level:d}_{x:d}_{y:d}.tile")
+
+    def __contains__(self, key: TILE_KEY) -> bool:
+        return key in self._keys
+
+    def write(self, key: TILE_KEY, grid: numpy.ndarray):
+        with open(self._file_path(key), mode="wb") as file:
+            file.write(zlib.compress(grid.tobytes(), 1))
+        self._keys.add(key)
+
+    def read(self, key: TILE_KEY, shape: Tuple[int, int]) -> Optional[numpy.ndarray]:
+        if key not in self._keys:
+            return None
+        with open(self._file_path(key), mode="rb") as file:
+            data = zlib.decompress(file.read())
+        return numpy.frombuffer(data, dtype=numpy.uint8).reshape(shape)
+
+
+class TileCache:
+    def __init__(self, tile_new: Callable[[], Tile], budget_bytes: int = 256 * 1024 ** 2, spill: Optional[Union[SpillDirectory, WorldStore]] = None):
+        self._tile_new = tile_new
+        self._budget_bytes = budget_bytes
+        self._spill = SpillDirectory() if spill is None else spill
+        self._tiles = OrderedDict()  # type: OrderedDict[TILE_KEY, Tile]
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __str__(self) -> str:
+        return f"{len(self._tiles):d} tiles, {self._bytes / 1024 ** 2:.1f} MB; hits {self.hits:d}, misses {self.misses:d}, evictions {self.evictions:d}"
+
+    def close(self):
+        self._spill.close()
+
+    def get(self, level: int, x: int, y: int) -> Optional[Tile]:
+        with self._lock:
+            return self._get(level, x, y)
+
+    def _get(self, level: int, x: int, y: int) -> Optional[Tile]:
+        key = level, x, y
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+        # neighbour probes for tiles that were never created are not misses
+        if key not in self._spill:
+            return None
+
+        self.misses += 1
+        tile = self._tile_new()
+        grid = self._spill.read(key, tile.grid.shape)
+        if grid is None:
+            return None
+        tile.grid[:, :] = grid
+        self._insert(key, tile)
+        return tile
+
+    def put(self, tile: Tile, level: int, x: int, y: int):
+        with self._lock:
+            self._put(tile, level, x, y)
+
+    def _put(self, tile: Tile, level: int, x: int, y: int):
+        key = level, x, y
+        tile_old = self._tiles.pop(key, None)
+        if tile_old is not None:
+            self._bytes -= tile_old.grid.nbytes
+        self._insert(key, tile)
+
+    def _insert(self, key: TILE_KEY, tile: Tile):
+        self._tiles[key] = tile
+        self._bytes += tile.grid.nbytes
+        self._evict()
+
+    def _evict(self):
+        while self._budget_bytes < self._bytes and 1 < len(self._tiles):
+            key_evicted, tile_evicted = self._tiles.popitem(last=False)
+            self._bytes -= tile_evicted.grid.nbytes
+            if key_evicted not in self._spill:
+                self._spill.write(key_evicted, tile_evicted.grid)
+            self.evictions += 1
+
+
+def _noise_worker(grid: numpy.ndarray, randomization: int, value_min: int, value_max: int, seed: int, key: TILE_KEY) -> numpy.ndarray:
+    _noise_array(grid, randomization, value_min, value_max, rng=_tile_rng(seed, *key))
+    return grid
 
 
 class Map:
-    def __init__(self, tile_size: int = 512, randomization: int = 30, value_min: int = 1, value_max: int = 255):
+    def __init__(self, tile_size: int = 512, randomization: int = 30, value_min: int = 1, value_max: int = 255, cache_budget_bytes: int = 256 * 1024 ** 2, path_spill: Optional[str] = None, seed: Optional[int] = None, path_world: Optional[str] = None, level_top: int = 5, level_min: int = -10):
+        _check_values(value_min, value_max)
+        if level_top < level_min:
+            raise ValueError(f"level_min must not be above level_top, not {level_min:d} and {level_top:d}")
         self._tile_size = tile_size
+        # every tile below level_top is refined from the tile above it, tiles from level_top upwards have no roof.
+        # a tile needs all tiles above it, level_min bounds that chain.
+        self._level_top = level_top
+        self._level_min = level_min
         self._randomization = randomization
         self._value_min, self._value_max = value_min, value_max
-        _tile_genesis = Tile(tile_size, randomization=randomization, value_min=value_min, value_max=value_max)
-        _tile_genesis.create_noise()
-        self._matrix_tile = {
-            0: {
-                0: {
-                    0: _tile_genesis
-                }
-            }
-        }
-
-    def _roof_tiles(self, tile: Tile, level: int, x: int, y: int, max_recursion_depth: int = 5):
-        level_above = level + 1
-        _x_top = x // 2
-        _y_top = y // 2
-
-        if level_above in self._matrix_tile and 0 < max_recursion_depth:
-            self._roof_tiles(tile, level_above, _x_top, _y_top, max_recursion_depth=max_recursion_depth-1)
-
-        tile_top = self._get_tile_maybe(level_above, _x_top, _y_top)
+        self._seed = random.getrandbits(63) if seed is None else seed
+
+        # tiles of a world are written through to its store and read back lazily
+        self._store = None if path_world is None else WorldStore(path_world)
+        spill = SpillDirectory(path_spill) if self._store is None else self._store
+        self._tiles = TileCache(self._new_tile, budget_bytes=cache_budget_bytes, spill=spill)
+        # a tile is generated under the lock of its stripe only, see _get_tile. a fixed number of stripes keeps
+        # memory bounded however many tiles are visited.
+        self._locks = tuple(threading.Lock() for _ in range(256))
+
+        # speculative work waits while foreground requests are running
+        self._foreground = 0
+        self._idle = threading.Condition()
+
+        if self._store is not None:
+            meta_stored = self._store.load_meta()
+            if seed is None and "seed" in meta_stored:
+                # a world reopened without a seed continues with its own
+                self._seed = meta_stored["seed"]
+            if 0 < len(meta_stored) and "level_min" not in meta_stored:
+                # level_min only limits which tiles are asked for, worlds stored without it take the given one
+                meta_stored["level_min"] = level_min
+                self._store.save_meta({"level_min": level_min})
+            meta = {"tile_size": tile_size, "randomization": randomization, "value_min": value_min, "value_max": value_max, "seed": self._seed, "level_top": level_top, "level_min": level_min}
+            if len(meta_stored) < 1:
+                self._store.save_meta(meta)
+            else:
+                fields = sorted(_field for _field in set(meta) | set(meta_stored) if meta.get(_field) != meta_stored.get(_field))
+                if 0 < len(fields):
+                    self._store.close()
+                    differences = ", ".join(f"{_field:s} stored {meta_stored.get(_field)}, given {meta.get(_field)}" for _field in fields)
+                    raise ValueError(f"world at <{path_world:s}> was created with other parameters: {differences:s}")
+
+    @staticmethod
+    def open(path_world: str, cache_budget_bytes: int = 256 * 1024 ** 2) -> "Map":
+        # the store creates its file, a missing world must not leave an empty one behind
+        if not os.path.isfile(path_world):
+            raise ValueError(f"no world at <{path_world:s}>")
+        store = WorldStore(path_world)
+        meta = store.load_meta()
+        store.close()
+        if len(meta) < 1:
+            raise ValueError(f"no world at <{path_world:s}>")
+        return Map(
+            tile_size=meta["tile_size"], randomization=meta["randomization"],
+            value_min=meta["value_min"], value_max=meta["value_max"], seed=meta["seed"],
+            level_top=meta.get("level_top", 5), level_min=meta.get("level_min", -10), cache_budget_bytes=cache_budget_bytes, path_world=path_world)
+
+    def __enter__(self) -> "Map":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        # the store is the spill of a world, otherwise this removes the temporary spill directory
+        self._tiles.close()
+
+    def _new_tile(self) -> Tile:
+        return Tile(self._tile_size, randomization=self._randomization, value_min=self._value_min, value_max=self._value_max)
+
+    def _roof_tiles(self, tile: Tile, level: int, x: int, y: int):
+        # the tile above holds everything that is known from further up
+        if self._level_top <= level:
+            return
+
+        tile_top = self._tiles.get(level + 1, x // 2, y // 2)
         if tile_top is not None:
-            snippet = tile_top.stretch(bool(x % 2), bool(y % 2))
-            tile.insert_tile(snippet, 0, 0)
-
-    def _base_tiles(self, tile: Tile, level: int, x: int, y: int, max_recursion_depth: int = 5):
-        level_below = level - 1
-        half_size = self._tile_size // 2
-        _x_low = x * 2
-        _y_low = y * 2
-
-        if level_below in self._matrix_tile and 0 < max_recursion_depth:
-            self._base_tiles(tile, level_below, _x_low, _y_low, max_recursion_depth=max_recursion_depth-1)
-            self._base_tiles(tile, level_below, _x_low + 1, _y_low, max_recursion_depth=max_recursion_depth-1)
-            self._base_tiles(tile, level_below, _x_low + 1, _y_low + 1, max_recursion_depth=max_recursion_depth-1)
-            self._base_tiles(tile, level_below, _x_low, _y_low + 1, max_recursion_depth=max_recursion_depth-1)
-
-        tile_nw = self._get_tile_maybe(level_below, _x_low, _y_low)
-        if tile_nw is not None:
-            shrunk = tile_nw.shrink()
-            tile.insert_tile(shrunk, 0, 0)
-
-        tile_ne = self._get_tile_maybe(level_below, _x_low + 1, _y_low)
-        if tile_ne is not None:
-            shrunk = tile_ne.shrink()
-            tile.insert_tile(shrunk, half_size, 0)
-
-        tile_se = self._get_tile_maybe(level_below, _x_low + 1, _y_low + 1)
-        if tile_se is not None:
-            shrunk = tile_se.shrink()
-            tile.insert_tile(shrunk, half_size, half_size)
-
-        tile_sw = self._get_tile_maybe(level_below, _x_low, _y_low + 1)
-        if tile_sw is not None:
-            shrunk = tile_sw.shrink()
-            tile.insert_tile(shrunk, 0, half_size)
+            tile.insert_tile(tile_top.stretch(bool(x % 2), bool(y % 2)), 0, 0)
 
     def _create_tile(self, level: int, x: int, y: int) -> Tile:
-        tile = Tile(self._tile_size, randomization=self._randomization, value_min=self._value_min, value_max=self._value_max)
+        tile = self._prepare_tile(level, x, y)
+        tile.create_noise(rng=_tile_rng(self._seed, level, x, y))
+        return tile
+
+    def _prepare_tile(self, level: int, x: int, y: int) -> Tile:
+        tile = self._new_tile()
         self._roof_tiles(tile, level, x, y)
-        self._base_tiles(tile, level, x, y)
 
         tile_north = self._get_tile_maybe(level, x, y - 1)
         tile_east = self._get_tile_maybe(level, x + 1, y)
@@ -337,89 +541,279 @@ class Map:
         tile_west = self._get_tile_maybe(level, x - 1, y)
 
         if tile_north is not None:
-            tile.edge_north = tile_north.edge_south
-            tile.corner_northwest = tile_north.corner_southwest
-            tile.corner_northeast = tile_north.corner_southeast
+            tile.edge_north[:] = tile_north.edge_south
         if tile_east is not None:
-            tile.edge_east = tile_east.edge_west
-            tile.corner_northeast = tile_east.corner_northwest
-            tile.corner_southeast = tile_east.corner_southwest
+            tile.edge_east[:] = tile_east.edge_west
         if tile_south is not None:
-            tile.edge_south = tile_south.edge_north
-            tile.corner_southeast = tile_south.corner_northeast
-            tile.corner_southwest = tile_south.corner_northwest
+            tile.edge_south[:] = tile_south.edge_north
         if tile_west is not None:
-            tile.edge_west = tile_west.edge_east
-            tile.corner_southwest = tile_west.corner_southeast
-            tile.corner_northwest = tile_west.corner_northeast
+            tile.edge_west[:] = tile_west.edge_east
 
-        if tile.corner_northwest.value < 1:
+        if tile.corner_northwest[0, 0] < 1:
             tile_northwest = self._get_tile_maybe(level, x - 1, y - 1)
             if tile_northwest is not None:
-                tile.corner_northwest = tile_northwest.corner_southeast
+                tile.corner_northwest[:] = tile_northwest.corner_southeast
 
-        if tile.corner_northeast.value < 1:
+        if tile.corner_northeast[0, 0] < 1:
             tile_northeast = self._get_tile_maybe(level, x + 1, y - 1)
             if tile_northeast is not None:
-                tile.corner_northeast = tile_northeast.corner_southwest
+                tile.corner_northeast[:] = tile_northeast.corner_southwest
 
-        if tile.corner_southeast.value < 1:
+        if tile.corner_southeast[0, 0] < 1:
             tile_southeast = self._get_tile_maybe(level, x + 1, y + 1)
             if tile_southeast is not None:
-                tile.corner_southeast = tile_southeast.corner_northwest
+                tile.corner_southeast[:] = tile_southeast.corner_northwest
 
-        if tile.corner_southwest.value < 1:
+        if tile.corner_southwest[0, 0] < 1:
             tile_southwest = self._get_tile_maybe(level, x - 1, y + 1)
             if tile_southwest is not None:
-                tile.corner_southwest = tile_southwest.corner_northeast
+                tile.corner_southwest[:] = tile_southwest.corner_northeast
 
-        tile.create_noise()
         return tile
 
     def _set_tile(self, tile: Tile, level: int, x: int, y: int):
-        map_level = self._matrix_tile.get(level)
-        if map_level is None:
-            self._matrix_tile[level] = {y: {x: tile}}
-        else:
-            column_tile = map_level.get(y)
-            if column_tile is None:
-                map_level[y] = {x: tile}
-            else:
-                column_tile[x] = tile
+        self._tiles.put(tile, level, x, y)
+        if self._store is not None:
+            self._store.write((level, x, y), tile.grid)
 
     def _get_tile_maybe(self, level: int, x: int, y: int) -> Optional[Tile]:
-        map_level = self._matrix_tile.get(level)
-        if map_level is None:
-            return None
-        column_tile = map_level.get(y)
-        if column_tile is None:
-            return None
-        return column_tile.get(x)
+        return self._tiles.get(level, x, y)
+
+    @property
+    def tile_size(self) -> int:
+        return self._tile_size
+
+    def get_tile(self, level: int, x: int, y: int) -> Tile:
+        with self.foreground():
+            return self._get_tile(level, x, y)
+
+    @contextmanager
+    def foreground(self) -> Iterator[None]:
+        with self._idle:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._foreground -= 1
+                self._idle.notify_all()
+
+    def wait_idle(self):
+        with self._idle:
+            self._idle.wait_for(lambda: self._foreground < 1)
+
+    @contextmanager
+    def _locked(self, keys: Iterable[TILE_KEY]) -> Iterator[None]:
+        # always acquired in sorted order so that overlapping sets cannot deadlock
+        locks = [self._locks[_i] for _i in sorted({hash(_key) % len(self._locks) for _key in keys})]
+        for _lock in locks:
+            _lock.acquire()
+        try:
+            yield
+        finally:
+            for _lock in reversed(locks):
+                _lock.release()
+
+    @staticmethod
+    def _phase(x: int, y: int) -> int:
+        return x % 2 + 2 * (y % 2)
+
+    @property
+    def level_top(self) -> int:
+        return self._level_top
+
+    @property
+    def level_min(self) -> int:
+        return self._level_min
+
+    def _check_level(self, level: int):
+        if level < self._level_min:
+            raise ValueError(f"level must not be below level_min {self._level_min:d}, not {level:d}")
+
+    def _dependencies(self, level: int, x: int, y: int) -> List[TILE_KEY]:
+        # the tile above and the neighbours of earlier parity phases, tiles of the same phase are never adjacent.
+        # finer levels are never read.
+        phase = Map._phase(x, y)
+        keys = [] if self._level_top <= level else [(level + 1, x // 2, y // 2)]
+        keys.extend(
+            (level, x + _x, y + _y)
+            for _y in range(-1, 2) for _x in range(-1, 2)
+            if Map._phase(x + _x, y + _y) < phase)
+        return keys
 
     def _get_tile(self, level: int, x: int, y: int) -> Tile:
+        # A tile is only ever created after the tile above it and its neighbours of earlier phases, and before its
+        # neighbours of later phases, just like in generate_tiles. Its content therefore only depends on the seed
+        # and its key, not on the order in which tiles of any level are requested, and adjacent tiles cannot be
+        # created at the same time. Missing dependencies are created coarse to fine, without recursion.
+        self._check_level(level)
         _tile = self._get_tile_maybe(level, x, y)
-        if _tile is None:
-            _tile = self._create_tile(level, x, y)
-            self._set_tile(_tile, level, x, y)
+        if _tile is not None:
+            return _tile
+
+        key = level, x, y
+        for each_phase in self._phases_missing([key]):
+            for _key in each_phase:
+                with self._locked([_key]):
+                    _tile = self._get_tile_maybe(*_key)
+                    if _tile is None:
+                        _tile = self._create_tile(*_key)
+                        self._set_tile(_tile, *_key)
+
+        # the requested tile is the only one in the last phase
         return _tile
 
-    def draw(self, level: int = 0, x: int = 0, y: int = 0, skip_render: bool = True):
+    def _phases_missing(self, keys: Iterable[TILE_KEY]) -> List[List[TILE_KEY]]:
+        # missing tiles and their missing dependencies, levels from coarse to fine and each level in four phases
+        keys_missing = set()  # type: Set[TILE_KEY]
+        keys_open = list(keys)
+        while 0 < len(keys_open):
+            key = keys_open.pop()
+            if key in keys_missing or self._get_tile_maybe(*key) is not None:
+                continue
+            keys_missing.add(key)
+            keys_open.extend(self._dependencies(*key))
+
+        phases = []
+        for _level in sorted({_level for _level, _, _ in keys_missing}, reverse=True):
+            for _x_parity, _y_parity in ((0, 0), (1, 0), (0, 1), (1, 1)):
+                each_phase = sorted(
+                    _key for _key in keys_missing
+                    if _key[0] == _level and _key[1] % 2 == _x_parity and _key[2] % 2 == _y_parity
+                )
+                if 0 < len(each_phase):
+                    phases.append(each_phase)
+        return phases
+
+    def generate_tiles(self, keys: Iterable[TILE_KEY], max_workers: Optional[int] = None, progress: Optional[Progress] = None):
+        # Tiles only depend on tiles that exist when they are prepared. Levels are processed from coarse to fine
+        # and each level in four phases of tiles that are not adjacent to each other, not even diagonally. Missing
+        # tiles above and neighbours of earlier phases are generated as well, so a tile comes out the same as from
+        # get_tile, whatever the order of the keys or the number of workers.
+        keys = list(keys)
+        for _level, _, _ in keys:
+            self._check_level(_level)
+        phases = self._phases_missing(keys)
+
+        executor = None if max_workers == 1 else ProcessPoolExecutor(max_workers=max_workers)
+        map_function = map if executor is None else executor.map
+        cells_tile = self._tile_size ** 2
+        try:
+            with ProgressPhase(progress, "tiles", total=sum(len(_phase) for _phase in phases)) as phase_progress:
+                for each_phase in phases:
+                    # only the tiles of one phase are locked, foreground requests elsewhere go on
+                    with self._locked(each_phase):
+                        keys_phase = [_key for _key in each_phase if self._get_tile_maybe(*_key) is None]
+                        tiles = [self._prepare_tile(*_key) for _key in keys_phase]
+                        grids = map_function(
+                            _noise_worker,
+                            [_tile.grid for _tile in tiles],
+                            [self._randomization] * len(tiles),
+                            [self._value_min] * len(tiles),
+                            [self._value_max] * len(tiles),
+                            [self._seed] * len(tiles),
+                            keys_phase)
+
+                        for _key, _tile, _grid in zip(keys_phase, tiles, grids):
+                            _tile.grid[:, :] = _grid
+                            self._set_tile(_tile, *_key)
+                            phase_progress.advance(cells=cells_tile)
+
+                    # tiles that foreground requests generated in the meantime
+                    if len(keys_phase) < len(each_phase):
+                        phase_progress.advance(steps=len(each_phase) - len(keys_phase))
+
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def draw(self, level: int = 0, x: int = 0, y: int = 0, skip_render: bool = True, blur_separable: bool = False):
         display = Tile(self._tile_size * 4, randomization=self._randomization, value_min=self._value_min, value_max=self._value_max)
 
-        for _x in range(-2, 2, 1):
-            for _y in range(-2, 2, 1):
-                tile = self._get_tile(level, x + _x, y + _y)
-                display.insert_tile(tile, x=(_x + 2) * self._tile_size, y=(_y + 2) * self._tile_size)
+        with self.foreground():
+            for _x in range(-2, 2, 1):
+                for _y in range(-2, 2, 1):
+                    tile = self._get_tile(level, x + _x, y + _y)
+                    display.insert_tile(tile, x=(_x + 2) * self._tile_size, y=(_y + 2) * self._tile_size)
+
+        display.draw(skip_render=skip_render, blur_separable=blur_separable)
 
-        display.draw(skip_render=skip_render)
+
+class TilePrefetcher:
+    def __init__(self, map_tiles: Map, max_workers: int = 2, depth: int = 1, zoom: bool = True):
+        self._map_tiles = map_tiles
+        self._depth = depth
+        self._zoom = zoom
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._pending = dict()  # type: Dict[TILE_KEY, Future]
+
+    def _ring(self, level: int, x: int, y: int, dx: int, dy: int) -> List[TILE_KEY]:
+        # Map.draw shows the tiles from x - 2 to x + 1 and from y - 2 to y + 1
+        x_range = range(x - 2 - self._depth, x + 2 + self._depth)
+        y_range = range(y - 2 - self._depth, y + 2 + self._depth)
+        if 0 < dx:
+            x_range = range(x + 2, x + 2 + self._depth)
+        elif dx < 0:
+            x_range = range(x - 2 - self._depth, x - 2)
+        if 0 < dy:
+            y_range = range(y + 2, y + 2 + self._depth)
+        elif dy < 0:
+            y_range = range(y - 2 - self._depth, y - 2)
+
+        return [
+            (level, _x, _y)
+            for _x in x_range for _y in y_range
+            if not (x - 2 <= _x < x + 2 and y - 2 <= _y < y + 2)
+        ]
+
+    @staticmethod
+    def _window(level: int, x: int, y: int) -> List[TILE_KEY]:
+        return [(level, x + _x, y + _y) for _x in range(-2, 2) for _y in range(-2, 2)]
+
+    def predict(self, level: int, x: int, y: int, dx: int = 0, dy: int = 0) -> List[TILE_KEY]:
+        keys = self._ring(level, x, y, dx, dy)
+        if self._zoom:
+            # queued last, i.e. lowest priority. tiles do not depend on the order of visits across levels either.
+            if level < self._map_tiles.level_top:
+                keys.extend(self._window(level + 1, x // 2, y // 2))
+            if self._map_tiles.level_min < level:
+                keys.extend(self._window(level - 1, x * 2, y * 2))
+        return keys
+
+    def _fetch(self, level: int, x: int, y: int):
+        self._map_tiles.wait_idle()
+        self._map_tiles._get_tile(level, x, y)
+
+    def update(self, level: int, x: int, y: int, dx: int = 0, dy: int = 0):
+        keys = self.predict(level, x, y, dx=dx, dy=dy)
+        keys_wanted = set(keys)
+
+        # drop stale work, e.g. the ring ahead when the direction is reversed
+        for _key, _future in list(self._pending.items()):
+            if _future.done():
+                del self._pending[_key]
+            elif _key not in keys_wanted and _future.cancel():
+                del self._pending[_key]
+
+        for _key in keys:
+            if _key not in self._pending:
+                self._pending[_key] = self._executor.submit(self._fetch, *_key)
+
+    def shutdown(self):
+        for _future in self._pending.values():
+            _future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
 
 
 class ViewState:
-    def __init__(self, map_tiles: Map):
+    def __init__(self, map_tiles: Map, prefetcher: Optional[TilePrefetcher] = None):
         self._map_tiles = map_tiles
+        self._prefetcher = prefetcher
         self._x = 0
         self._y = 0
         self._level = 0
+        self._direction = 0, 0
 
     def __str__(self) -> str:
         return f"{self._x:d}, {self._y:d}; {self._level:d}"
@@ -427,38 +821,58 @@ class ViewState:
     def north(self):
         print("north")
         self._y -= 1
+        self._prefetch(0, -1)
 
     def east(self):
         print("east")
         self._x += 1
+        self._prefetch(1, 0)
 
     def south(self):
         print("south")
         self._y += 1
+        self._prefetch(0, 1)
 
     def west(self):
         print("west")
         self._x -= 1
+        self._prefetch(-1, 0)
 
     def zoom_in(self):
+        # below the minimum level the chain of tiles above would grow without bound
+        if self._level <= self._map_tiles.level_min:
+            return
         print("zoom in")
         self._level -= 1
         self._y *= 2
         self._x *= 2
+        self._prefetch(0, 0)
 
     def zoom_out(self):
+        # above the top level tiles are no longer refinements of each other
+        if self._map_tiles.level_top <= self._level:
+            return
         print("zoom out")
         self._level += 1
         self._y //= 2  # plus modulo sth
         self._x //= 2  # plus modulo sth
+        self._prefetch(0, 0)
+
+    def _prefetch(self, dx: int, dy: int):
+        self._direction = dx, dy
 
     def draw(self):
         self._map_tiles.draw(self._level, self._x, self._y, skip_render=True)
+        # speculative work is only queued once the frame is done
+        if self._prefetcher is not None:
+            dx, dy = self._direction
+            self._prefetcher.update(self._level, self._x, self._y, dx=dx, dy=dy)
 
 
 def main():
-    map_tiles = Map(tile_size=64, randomization=64)
-    view_state = ViewState(map_tiles)
+    map_tiles = Map(tile_size=64, randomization=64, seed=2346464)
+    prefetcher = TilePrefetcher(map_tiles, zoom=True)
+    view_state = ViewState(map_tiles, prefetcher=prefetcher)
 
     def press(event):
         if event.key == "up":
@@ -493,8 +907,42 @@ def main():
     view_state.draw()
 
     pyplot.show()
+    prefetcher.shutdown()
+    map_tiles.close()
+
+
+def _benchmark_render(size: int = 2048, repetitions: int = 3):
+    tile = Tile(size, randomization=30)
+    tile.create_noise()
+    data = tile.grid[:-1, :-1]
+
+    durations_pil, durations_array = [], []
+    for _ in range(repetitions):
+        time_start = time.perf_counter()
+        _render(Image.fromarray(data, "L"))
+        durations_pil.append(time.perf_counter() - time_start)
+
+        time_start = time.perf_counter()
+        _render_array(data)
+        durations_array.append(time.perf_counter() - time_start)
+
+    print(f"pil blur: {min(durations_pil) * 1000.:.1f} ms for image size {size:d}")
+    print(f"separable blur: {min(durations_array) * 1000.:.1f} ms for image size {size:d}")
+
+
+def _benchmark_noise(size: int = 512, repetitions: int = 3):
+    for vectorized in (False, True):
+        durations = []
+        for _ in range(repetitions):
+            tile = Tile(size, randomization=30)
+            time_start = time.perf_counter()
+            tile.create_noise(vectorized=vectorized)
+            durations.append(time.perf_counter() - time_start)
+        name = "numpy" if vectorized else "python"
+        print(f"{name:s}: {min(durations) * 1000.:.1f} ms for tile size {size:d}")
 
 
 if __name__ == "__main__":
     random.seed(2346464)
+    numpy.random.seed(2346464)
     main()
@@ -0,0 +1,151 @@
+import argparse
+import os
+import struct
+import zlib
+from typing import Optional, Union
+
+import numpy
+from matplotlib import colormaps
+
+from src.fractal.fractal_noise import Map
+
+
+class _PngWriter:
+    # writes rows as they come in, only the compressor state is kept in memory
+    def __init__(self, file_path: str, width: int, height: int, channels: int):
+        self._file = open(file_path, mode="wb")
+        self._row_bytes = width * channels
+        self._row_last = numpy.zeros(self._row_bytes, dtype=numpy.uint8)
+        self._compressor = zlib.compressobj(6)
+
+        color_type = 0 if channels == 1 else 2
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    def write(self, rows: numpy.ndarray):
+        rows = rows.reshape(rows.shape[0], self._row_bytes)
+
+        # filter type 2, difference to the row above
+        filtered = numpy.empty((rows.shape[0], self._row_bytes + 1), dtype=numpy.uint8)
+        filtered[:, 0] = 2
+        filtered[0, 1:] = rows[0] - self._row_last
+        filtered[1:, 1:] = rows[1:] - rows[:-1]
+        self._row_last = rows[-1].copy()
+
+        data = self._compressor.compress(filtered.tobytes())
+        if 0 < len(data):
+            self._chunk(b"IDAT", data)
+
+    def close(self):
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+        self._file.close()
+
+
+class _NpyWriter:
+    def __init__(self, file_path: str, width: int, height: int, channels: int):
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        self._array = numpy.lib.format.open_memmap(file_path, mode="w+", dtype=numpy.uint8, shape=shape)
+        self._row = 0
+
+    def write(self, rows: numpy.ndarray):
+        self._array[self._row:self._row + rows.shape[0]] = rows
+        self._array.flush()
+        self._row += rows.shape[0]
+
+    def close(self):
+        del self._array
+
+
+class _RawWriter:
+    def __init__(self, file_path: str, width: int, height: int, channels: int):
+        self._file = open(file_path, mode="wb")
+
+    def write(self, rows: numpy.ndarray):
+        self._file.write(numpy.ascontiguousarray(rows).tobytes())
+
+    def close(self):
+        self._file.close()
+
+
+def _writer(file_path: str, width: int, height: int, channels: int) -> Union[_PngWriter, _NpyWriter, _RawWriter]:
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".png":
+        return _PngWriter(file_path, width, height, channels)
+    if extension == ".npy":
+        return _NpyWriter(file_path, width, height, channels)
+    return _RawWriter(file_path, width, height, channels)
+
+
+def render_region(
+        map_tiles: Map, file_path: str, level: int, x: int, y: int, width: int, height: int,
+        colormap: Optional[str] = None, max_workers: Optional[int] = 1):
+    # x, y, width and height are pixels at the given level, one band of tile rows is held in memory at a time
+    tile_size = map_tiles.tile_size
+    x_tile_first, x_tile_last = x // tile_size, (x + width - 1) // tile_size
+    y_tile_first, y_tile_last = y // tile_size, (y + height - 1) // tile_size
+    x_band = x - x_tile_first * tile_size
+
+    lookup = None
+    if colormap is not None:
+        lookup = numpy.uint8(colormaps[colormap](numpy.arange(256))[:, :3] * 255.)
+
+    writer = _writer(file_path, width, height, 1 if lookup is None else 3)
+    band = numpy.empty((tile_size, (x_tile_last - x_tile_first + 1) * tile_size), dtype=numpy.uint8)
+    try:
+        for _y_tile in range(y_tile_first, y_tile_last + 1):
+            keys = [(level, _x_tile, _y_tile) for _x_tile in range(x_tile_first, x_tile_last + 1)]
+            map_tiles.generate_tiles(keys, max_workers=max_workers)
+
+            for _i, _key in enumerate(keys):
+                tile = map_tiles.get_tile(*_key)
+                band[:, _i * tile_size:(_i + 1) * tile_size] = tile.grid[:-1, :-1]
+
+            y_from = max(y, _y_tile * tile_size) - _y_tile * tile_size
+            y_to = min(y + height, (_y_tile + 1) * tile_size) - _y_tile * tile_size
+            rows = band[y_from:y_to, x_band:x_band + width]
+            writer.write(rows if lookup is None else lookup[rows])
+
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="render a rectangle of an infinite fractal map without a display")
+    parser.add_argument("output", help="target file, .png, .npy or anything else for raw uint8 rows")
+    parser.add_argument("--world", default=None, help="world store to read tiles from and write new tiles to")
+    parser.add_argument("--level", type=int, default=0)
+    parser.add_argument("--x", type=int, default=0, help="left pixel at the given level")
+    parser.add_argument("--y", type=int, default=0, help="top pixel at the given level")
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--height", type=int, default=2048)
+    parser.add_argument("--tile-size", type=int, default=512)
+    parser.add_argument("--randomization", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=2346464)
+    parser.add_argument("--cache-mb", type=int, default=256)
+    parser.add_argument("--colormap", default=None, help="matplotlib colormap name, grayscale if omitted")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    cache_budget_bytes = args.cache_mb * 1024 ** 2
+    if args.world is not None and os.path.isfile(args.world):
+        map_tiles = Map.open(args.world, cache_budget_bytes=cache_budget_bytes)
+    else:
+        map_tiles = Map(
+            tile_size=args.tile_size, randomization=args.randomization, seed=args.seed,
+            cache_budget_bytes=cache_budget_bytes, path_world=args.world)
+
+    render_region(
+        map_tiles, args.output, args.level, args.x, args.y, args.width, args.height,
+        colormap=args.colormap, max_workers=args.workers)
+    map_tiles.close()
+
+
+if __name__ == "__main__":
+    main()
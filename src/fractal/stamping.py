@@ -0,0 +1,113 @@
+import math
+from typing import Sequence, Tuple, Optional, Union, Callable
+
+import numpy
+
+# points are given in axis order, (y, x) for images. a value is either a constant or a function that receives one
+# broadcastable coordinate array per axis and returns the values for those cells
+VALUE = Union[float, Callable[..., numpy.ndarray]]
+
+
+def _bounding_box(shape: Sequence[int], lower: Sequence[float], upper: Sequence[float]) -> Optional[Tuple[slice, ...]]:
+    # lower and upper are inclusive integer bounds before clipping
+    box = tuple(
+        slice(max(0, math.ceil(_l)), min(_s, math.floor(_u) + 1))
+        for _s, _l, _u in zip(shape, lower, upper))
+    if any(_b.stop <= _b.start for _b in box):
+        return None
+    return box
+
+
+def _coordinates(box: Tuple[slice, ...]) -> Tuple[numpy.ndarray, ...]:
+    return tuple(numpy.ogrid[tuple(box)]) if 1 < len(box) else (numpy.arange(box[0].start, box[0].stop), )
+
+
+def _stamp(grid: numpy.ndarray, box: Tuple[slice, ...], inside: Optional[numpy.ndarray], value: VALUE):
+    target = grid[box]
+    shape = target.shape
+    if callable(value):
+        values = numpy.broadcast_to(value(*_coordinates(box)), shape)
+    else:
+        values = numpy.broadcast_to(numpy.asarray(value, dtype=grid.dtype), shape)
+
+    if inside is None:
+        target[...] = values
+    else:
+        inside = numpy.broadcast_to(inside, shape)
+        target[inside] = values[inside]
+
+
+def stamp_mask(grid: numpy.ndarray, mask: numpy.ndarray, offset: Sequence[int], value: VALUE = 1.):
+    # cells where mask is set are stamped, mask cell 0 lands on offset, parts outside the grid are dropped
+    assert mask.ndim == grid.ndim
+    box = _bounding_box(grid.shape, offset, [_o + _s - 1 for _o, _s in zip(offset, mask.shape)])
+    if box is None:
+        return
+    mask_box = tuple(slice(_b.start - _o, _b.stop - _o) for _b, _o in zip(box, offset))
+    _stamp(grid, box, mask[mask_box].astype(bool, copy=False), value)
+
+
+def stamp_ball(grid: numpy.ndarray, center: Sequence[float], radius: float, value: VALUE = 1.):
+    assert len(center) == grid.ndim
+    box = _bounding_box(grid.shape, [_c - radius for _c in center], [_c + radius for _c in center])
+    if box is None:
+        return
+
+    distance = sum((_a - _c) ** 2 for _a, _c in zip(_coordinates(box), center))
+    _stamp(grid, box, distance < radius ** 2, value)
+
+
+def stamp_line(grid: numpy.ndarray, start: Sequence[float], end: Sequence[float], width: float = 1., value: VALUE = 1.):
+    # every cell closer than width / 2 to the segment
+    assert len(start) == len(end) == grid.ndim
+    radius = width / 2.
+    box = _bounding_box(
+        grid.shape,
+        [min(_s, _e) - radius for _s, _e in zip(start, end)],
+        [max(_s, _e) + radius for _s, _e in zip(start, end)])
+    if box is None:
+        return
+
+    coordinates = _coordinates(box)
+    direction = [_e - _s for _s, _e in zip(start, end)]
+    length = sum(_d ** 2 for _d in direction)
+    if length == 0.:
+        projection = 0.
+    else:
+        projection = sum((_a - _s) * _d for _a, _s, _d in zip(coordinates, start, direction)) / length
+        projection = numpy.clip(projection, 0., 1.)
+
+    distance = sum((_a - _s - projection * _d) ** 2 for _a, _s, _d in zip(coordinates, start, direction))
+    _stamp(grid, box, distance < radius ** 2, value)
+
+
+def stamp_cross(grid: numpy.ndarray, center: Sequence[float], half_widths: Sequence[float], value: VALUE = 1.):
+    # one slab per axis, cells strictly within half_width of the center along that axis
+    assert len(center) == len(half_widths) == grid.ndim
+    for _axis, (_c, _h) in enumerate(zip(center, half_widths)):
+        lower = [0.] * grid.ndim
+        upper = [_s - 1. for _s in grid.shape]
+        lower[_axis] = math.floor(_c - _h) + 1
+        upper[_axis] = math.ceil(_c + _h) - 1
+        box = _bounding_box(grid.shape, lower, upper)
+        if box is not None:
+            _stamp(grid, box, None, value)
+
+
+def stamp_polygon(grid: numpy.ndarray, vertices: Sequence[Tuple[float, float]], value: VALUE = 1.):
+    # even-odd rule on cell centers, the grid is two dimensional
+    assert grid.ndim == 2 and 3 <= len(vertices)
+    ys, xs = zip(*vertices)
+    box = _bounding_box(grid.shape, (min(ys), min(xs)), (max(ys), max(xs)))
+    if box is None:
+        return
+
+    y, x = _coordinates(box)
+    inside = numpy.zeros((len(y), x.shape[1]), dtype=bool)
+    for (_y_a, _x_a), (_y_b, _x_b) in zip(vertices, vertices[1:] + vertices[:1]):
+        if _y_a == _y_b:
+            continue
+        crosses = (_y_a <= y) != (_y_b <= y)
+        x_cross = _x_a + (y - _y_a) * (_x_b - _x_a) / (_y_b - _y_a)
+        inside ^= crosses & (x < x_cross)
+    _stamp(grid, box, inside, value)
@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Dict
+
+import numpy
+from PIL import Image
+from matplotlib import colormaps
+
+from src.fractal.fractal_noise import Map, TILE_KEY
+
+_PATH_TILE = re.compile(r"^/(-?\d+)/(-?\d+)/(-?\d+)\.png$")
+
+_REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+# tile keys are packed as int64, children of a tile must still fit
+_COORDINATE_LIMIT = 2 ** 62
+
+
+class TileServer:
+    def __init__(self, map_tiles: Map, max_generating: int = 2, cache_entries: int = 1024, colormap: Optional[str] = None):
+        self._map_tiles = map_tiles
+        self._max_generating = max_generating
+        self._cache_entries = cache_entries
+        self._lookup = None
+        if colormap is not None:
+            self._lookup = numpy.uint8(colormaps[colormap](numpy.arange(256))[:, :3] * 255.)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_generating, thread_name_prefix="tiles")
+        self._semaphore = None  # type: Optional[asyncio.Semaphore]
+        self._responses = OrderedDict()  # type: OrderedDict[TILE_KEY, Tuple[str, bytes]]
+        self._in_flight = dict()  # type: Dict[TILE_KEY, asyncio.Future]
+
+        self.encoded = 0
+
+    def _encode(self, key: TILE_KEY) -> Tuple[str, bytes]:
+        tile = self._map_tiles.get_tile(*key)
+        data = tile.grid[:-1, :-1]
+        image = Image.fromarray(data, "L") if self._lookup is None else Image.fromarray(self._lookup[data], "RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        png = buffer.getvalue()
+        etag = f"\"{hashlib.blake2b(png, digest_size=16).hexdigest():s}\""
+        return etag, png
+
+    async def _png(self, key: TILE_KEY) -> Tuple[str, bytes]:
+        response = self._responses.get(key)
+        if response is not None:
+            self._responses.move_to_end(key)
+            return response
+
+        # viewers asking for the same tile wait for the one generation already under way
+        future = self._in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._in_flight[key] = future
+        try:
+            async with self._semaphore:
+                response = await loop.run_in_executor(self._executor, self._encode, key)
+            self.encoded += 1
+            self._responses[key] = response
+            while self._cache_entries < len(self._responses):
+                self._responses.popitem(last=False)
+            future.set_result(response)
+
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved here, waiting viewers still receive it
+            raise
+
+        finally:
+            # e.g. the generating request was cancelled, waiting viewers must not hang
+            if not future.done():
+                future.set_exception(RuntimeError(f"generation of tile {key} was cancelled"))
+                future.exception()
+            del self._in_flight[key]
+
+        return response
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, headers: Optional[Dict[str, str]] = None, body: bytes = b"", head: bool = False):
+        headers = dict() if headers is None else dict(headers)
+        headers["Content-Length"] = str(len(body))
+        headers["Connection"] = "close"
+        lines = [f"HTTP/1.1 {status:d} {_REASONS[status]:s}"] + [f"{_k:s}: {_v:s}" for _k, _v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if not head:
+            writer.write(body)
+        await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            headers = dict()
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if len(line) < 1:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            parts = request_line.split()
+            if len(parts) != 3:
+                await self._respond(writer, 400)
+                return
+
+            method, path, _ = parts
+            if method not in ("GET", "HEAD"):
+                await self._respond(writer, 405, headers={"Allow": "GET, HEAD"})
+                return
+
+            match = _PATH_TILE.match(path.split("?", 1)[0])
+            if match is None:
+                await self._respond(writer, 404)
+                return
+
+            key = tuple(int(_v) for _v in match.groups())
+            level, _, _ = key
+            # a tile needs all tiles above it, deep levels would make the map generate without bound
+            if not self._map_tiles.level_min <= level <= self._map_tiles.level_top:
+                await self._respond(writer, 400)
+                return
+            if not all(-_COORDINATE_LIMIT <= _v < _COORDINATE_LIMIT for _v in key):
+                await self._respond(writer, 400)
+                return
+
+            try:
+                etag, png = await self._png(key)
+            except Exception:
+                await self._respond(writer, 500)
+                return
+
+            headers_response = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+            if headers.get("if-none-match") == etag:
+                await self._respond(writer, 304, headers=headers_response, head=True)
+                return
+
+            headers_response["Content-Type"] = "image/png"
+            await self._respond(writer, 200, headers=headers_response, body=png, head=method == "HEAD")
+
+        except ConnectionError:
+            pass
+
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8000) -> asyncio.AbstractServer:
+        self._semaphore = asyncio.Semaphore(self._max_generating)
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8000):
+        server = await self.start(host=host, port=port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve fractal map tiles at /{level}/{x}/{y}.png")
+    parser.add_argument("--world", default=None, help="world store to read tiles from and write new tiles to")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--tile-size", type=int, default=256)
+    parser.add_argument("--randomization", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=2346464)
+    parser.add_argument("--generating", type=int, default=2, help="tiles generated at the same time")
+    parser.add_argument("--colormap", default=None, help="matplotlib colormap name, grayscale if omitted")
+    args = parser.parse_args()
+
+    if args.world is not None and os.path.isfile(args.world):
+        map_tiles = Map.open(args.world)
+    else:
+        map_tiles = Map(tile_size=args.tile_size, randomization=args.randomization, seed=args.seed, path_world=args.world)
+
+    server = TileServer(map_tiles, max_generating=args.generating, colormap=args.colormap)
+    try:
+        asyncio.run(server.serve(host=args.host, port=args.port))
+    finally:
+        server.close()
+        map_tiles.close()
+
+
+if __name__ == "__main__":
+    main()
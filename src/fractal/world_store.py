@@ -0,0 +1,60 @@
+import sqlite3
+import threading
+import zlib
+from typing import Tuple, Optional, Dict, Any
+
+import numpy
+
+
+class WorldStore:
+    # one compressed uint8 block per (level, x, y), the primary key doubles as spatial index
+    def __init__(self, path: str, compression: int = 6):
+        self._path = path
+        self._compression = compression
+        self._lock = threading.Lock()
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS tiles ("
+            "level INTEGER NOT NULL, x INTEGER NOT NULL, y INTEGER NOT NULL, data BLOB NOT NULL, "
+            "PRIMARY KEY (level, y, x)) WITHOUT ROWID")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def load_meta(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._connection.execute("SELECT key, value FROM meta").fetchall()
+        return dict(rows)
+
+    def save_meta(self, meta: Dict[str, Any]):
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items())
+            self._connection.commit()
+
+    def __contains__(self, key: Tuple[int, int, int]) -> bool:
+        level, x, y = key
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM tiles WHERE level = ? AND y = ? AND x = ?", (level, y, x)).fetchone()
+        return row is not None
+
+    def write(self, key: Tuple[int, int, int], grid: numpy.ndarray):
+        level, x, y = key
+        data = zlib.compress(numpy.ascontiguousarray(grid, dtype=numpy.uint8).tobytes(), self._compression)
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO tiles (level, x, y, data) VALUES (?, ?, ?, ?)", (level, x, y, data))
+            self._connection.commit()
+
+    def read(self, key: Tuple[int, int, int], shape: Tuple[int, int]) -> Optional[numpy.ndarray]:
+        level, x, y = key
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM tiles WHERE level = ? AND y = ? AND x = ?", (level, y, x)).fetchone()
+        if row is None:
+            return None
+        data, = row
+        return numpy.frombuffer(zlib.decompress(data), dtype=numpy.uint8).reshape(shape)
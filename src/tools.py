@@ -3,7 +3,7 @@ import json
 import os
 import random
 import time
-from typing import TypeVar, Generic, Dict, Any
+from typing import TypeVar, Generic, Dict, Any, Optional
 
 T = TypeVar("T")
 
@@ -29,6 +29,70 @@ class Timer:
         return True
 
 
+class Progress:
+    # observer for long runs, the base class is the silent default
+    def start(self, phase: str, total: int):
+        pass
+
+    def advance(self, phase: str, done: int, total: int, cells: int):
+        pass
+
+    def finish(self, phase: str, seconds: float, cells: int):
+        pass
+
+
+NO_PROGRESS = Progress()
+
+
+class PrintProgress(Progress):
+    # at most one line per phase and interval, unlike Timer every instance has its own clock
+    def __init__(self, interval_ms: int = 1000):
+        self._interval = interval_ms / 1000.
+        self._last = dict()  # type: Dict[str, float]
+
+    def start(self, phase: str, total: int):
+        self._last[phase] = time.perf_counter()
+
+    def advance(self, phase: str, done: int, total: int, cells: int):
+        now = time.perf_counter()
+        if now - self._last.get(phase, 0.) < self._interval:
+            return
+        self._last[phase] = now
+        print(f"{phase:s}: finished {done:d} of {total:d}...")
+
+    def finish(self, phase: str, seconds: float, cells: int):
+        rate = cells / seconds if 0. < seconds else 0.
+        print(f"{phase:s}: {seconds:.2f} s, {rate:.0f} cells per second")
+
+
+class ProgressPhase:
+    # times one phase of a run and counts its steps and cells, the silent default is not called at all
+    def __init__(self, progress: Optional[Progress], phase: str, total: int = 0):
+        self._progress = NO_PROGRESS if progress is None else progress
+        self._silent = type(self._progress) is Progress
+        self._phase = phase
+        self._total = total
+        self._time_start = 0.
+        self.done = 0
+        self.cells = 0
+
+    def __enter__(self) -> "ProgressPhase":
+        self._time_start = time.perf_counter()
+        if not self._silent:
+            self._progress.start(self._phase, self._total)
+        return self
+
+    def advance(self, cells: int = 0, steps: int = 1):
+        self.done += steps
+        self.cells += cells
+        if not self._silent:
+            self._progress.advance(self._phase, self.done, self._total, self.cells)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self._silent and exc_type is None:
+            self._progress.finish(self._phase, time.perf_counter() - self._time_start, self.cells)
+
+
 def bulk_rename(path_pattern: str, name: str):
     files = glob.glob(path_pattern)
     random.shuffle(files)
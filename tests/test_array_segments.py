@@ -0,0 +1,44 @@
+import itertools
+import random
+
+import numpy
+import pytest
+
+from src.fractal.fractal_n_dim import _array_segments
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_segments_match_slicing(seed: int):
+    # against slicing every window out of the array by hand
+    generator = random.Random(seed)
+    rng = numpy.random.default_rng(seed)
+
+    dim = generator.randint(1, 4)
+    shape_array = tuple(generator.randint(1, 9) for _ in range(dim))
+    shape_segments = tuple(generator.randint(1, _a) for _a in shape_array)
+    overlap = tuple(generator.randint(0, _s - 1) for _s in shape_segments)
+    step = tuple(_s - _o for _s, _o in zip(shape_segments, overlap))
+
+    array = rng.random(shape_array)
+    array = array[tuple(slice(None, None, generator.choice((1, -1))) for _ in range(dim))]
+
+    starts = tuple(range(0, _a - _s + 1, _t) for _a, _s, _t in zip(shape_array, shape_segments, step))
+    expected = [
+        array[tuple(slice(_c, _c + _s) for _c, _s in zip(_corner, shape_segments))]
+        for _corner in itertools.product(*starts)]
+
+    segments = list(_array_segments(array, shape_segments, overlap=overlap))
+    assert len(segments) == len(expected)
+    for _segment, _expected in zip(segments, expected):
+        assert numpy.shares_memory(_segment, array)
+        assert numpy.array_equal(_segment, _expected)
+
+
+def test_segments_write_through():
+    array = numpy.zeros((5, 5))
+    for _segment in _array_segments(array, (3, 3), overlap=(1, 1)):
+        _segment += 1.
+
+    assert array[0, 0] == 1.
+    assert array[0, 2] == 2.
+    assert array[2, 2] == 4.
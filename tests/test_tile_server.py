@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import urllib.error
+import urllib.request
+from typing import Dict, Optional, Tuple
+
+from src.fractal.fractal_noise import Map, Tile
+from src.fractal.tile_server import TileServer
+
+
+class _Tiles:
+    # holds generation back until released, level 3 fails
+    def __init__(self):
+        self.map_tiles = Map(tile_size=32, seed=2346464)
+        self.release = threading.Event()
+        self.levels = []
+
+    @property
+    def level_min(self) -> int:
+        return self.map_tiles.level_min
+
+    @property
+    def level_top(self) -> int:
+        return self.map_tiles.level_top
+
+    def get_tile(self, level: int, x: int, y: int) -> Tile:
+        self.levels.append(level)
+        if level == 3:
+            raise RuntimeError("broken tile")
+        self.release.wait(timeout=5.)
+        return self.map_tiles.get_tile(level, x, y)
+
+
+def _get(port: int, path: str, headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+    request = urllib.request.Request(f"http://127.0.0.1:{port:d}{path:s}", headers=dict() if headers is None else headers)
+    try:
+        with urllib.request.urlopen(request, timeout=10.) as response:
+            return response.status, dict(response.headers), response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), e.read()
+
+
+async def _scenario(tiles: _Tiles, server: TileServer) -> Dict[str, Tuple[int, Dict[str, str], bytes]]:
+    listening = await server.start(port=0)
+    port = listening.sockets[0].getsockname()[1]
+    loop = asyncio.get_running_loop()
+
+    def get(path: str, headers: Optional[Dict[str, str]] = None) -> asyncio.Future:
+        return loop.run_in_executor(None, _get, port, path, headers)
+
+    results = dict()
+    try:
+        first, second = get("/0/1/2.png"), get("/0/1/2.png")
+        await asyncio.sleep(.5)
+        tiles.release.set()
+        results["first"], results["second"] = await first, await second
+
+        _, headers, _ = results["first"]
+        results["cached"] = await get("/0/1/2.png", headers={"If-None-Match": headers["ETag"]})
+        results["unknown"] = await get("/tiles/0/1/2.png")
+        results["outside"] = await get("/99999999999999999999999/0/0.png")
+        results["failing"] = await get("/3/0/0.png")
+        results["deep"] = await get("/-100000/3/3.png")
+
+    finally:
+        listening.close()
+        await listening.wait_closed()
+
+    return results
+
+
+def test_server():
+    tiles = _Tiles()
+    server = TileServer(tiles)
+    try:
+        results = asyncio.run(_scenario(tiles, server))
+    finally:
+        server.close()
+        tiles.map_tiles.close()
+
+    status_first, _, png_first = results["first"]
+    status_second, _, png_second = results["second"]
+    assert status_first == status_second == 200
+    assert png_first == png_second
+    assert png_first.startswith(b"\x89PNG")
+    assert server.encoded == 1
+
+    status, _, body = results["cached"]
+    assert status == 304
+    assert len(body) < 1
+
+    assert results["unknown"][0] == 404
+    assert results["outside"][0] == 400
+    assert results["failing"][0] == 500
+    assert results["deep"][0] == 400
+    assert -100000 not in tiles.levels